@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# imports.py
+#
+# Author: Yann KOETH
+# Created: Wed Dec  3 11:40:18 2014 (+0100)
+# Last-Updated: Wed Dec  3 12:26:51 2014 (+0100)
+#           By: Yann KOETH
+#     Update #: 24
+#
+
+"""Import time of the OCR core, which must not load Qt.
+
+    python benchmarks/imports.py --budget 500
+
+Each module is imported in a fresh interpreter. Exits with an error
+if a core module pulls in a forbidden module or exceeds the budget.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CORE = ['mediocre.models', 'mediocre.dataset', 'mediocre.ocr',
+        'mediocre.page', 'mediocre.classes', 'mediocre.cli']
+
+REFERENCE = ['numpy', 'cv2']
+
+FORBIDDEN = ['PyQt5', 'PyQt4', 'sip']
+
+CHILD = """
+import json, sys, timeit
+start = timeit.default_timer()
+__import__({0!r})
+elapsed = timeit.default_timer() - start
+print json.dumps({{'elapsed': elapsed, 'modules': sorted(sys.modules)}})
+"""
+
+
+def measure(module):
+    """Returns the import time of module and the modules it loaded.
+    """
+    output = subprocess.check_output([sys.executable, '-c', CHILD.format(module)],
+                                     cwd=ROOT)
+    result = json.loads(output.splitlines()[-1])
+    return result['elapsed'], result['modules']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('modules', nargs='*', default=CORE)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--budget', type=float, default=500,
+                        help="maximum import time of a module, in ms")
+    args = parser.parse_args()
+
+    for module in REFERENCE:
+        print "  {0:<20} {1:8.1f} ms  (reference)".format(module,
+                                                       measure(module)[0] * 1000)
+    failed = False
+    for module in args.modules:
+        elapsed = float('inf')
+        for i in xrange(args.repeat):
+            time, loaded = measure(module)
+            elapsed = min(elapsed, time)
+        forbidden = sorted(set(name.split('.')[0] for name in loaded) & set(FORBIDDEN))
+        status = ''
+        if forbidden:
+            status = "imports " + ", ".join(forbidden)
+        elif elapsed * 1000 > args.budget:
+            status = "over budget"
+        failed = failed or bool(status)
+        print "  {0:<20} {1:8.1f} ms  {2}".format(module, elapsed * 1000, status)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
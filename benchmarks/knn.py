@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# knn.py
+#
+# Author: Yann KOETH
+# Created: Mon Dec  1 17:03:44 2014 (+0100)
+# Last-Updated: Mon Dec  1 18:21:30 2014 (+0100)
+#           By: Yann KOETH
+#     Update #: 36
+#
+
+"""Compare the nearest neighbors indexes of mediocre.neighbors.
+
+    python benchmarks/knn.py --sizes 10000 100000 1000000
+"""
+
+import argparse
+import os
+import sys
+import timeit
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mediocre import neighbors
+
+
+def synthetic(count, size, nClass, rand):
+    """Noisy copies of one random 16x16 binary glyph per class.
+    """
+    centers = (rand.rand(nClass, size) > .7) * 255
+    responses = rand.randint(0, nClass, count)
+    samples = np.empty((count, size), np.uint8)
+    for start in xrange(0, count, 65536):
+        r = responses[start:start + 65536]
+        noise = rand.randint(-96, 96, (len(r), size))
+        samples[start:start + len(r)] = np.clip(centers[r] + noise, 0, 255)
+    return samples, responses
+
+
+def run(name, Index, samples, responses, queries, k, nClass, **kwargs):
+    start = timeit.default_timer()
+    index = Index(samples, responses, **kwargs)
+    build = timeit.default_timer() - start
+    start = timeit.default_timer()
+    found, distances = index.search(queries, k)
+    elapsed = timeit.default_timer() - start
+    predict = neighbors.vote(np.int64(found), nClass)
+    print "  {0:<16} build {1:8.3f} s   query {2:8.3f} ms/sample".format(
+        name, build, elapsed * 1000 / len(queries))
+    return predict
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10000, 100000, 1000000])
+    parser.add_argument('--queries', type=int, default=1000)
+    parser.add_argument('-k', type=int, default=6)
+    parser.add_argument('--recall', type=float, default=.1)
+    parser.add_argument('--classes', type=int, default=62)
+    parser.add_argument('--no-opencv', action='store_true',
+                        help="skip cv2.KNearest (slow on large sizes)")
+    args = parser.parse_args()
+
+    rand = np.random.RandomState(0)
+    for size in args.sizes:
+        samples, responses = synthetic(size, 256, args.classes, rand)
+        queries, truth = synthetic(args.queries, 256, args.classes,
+                                   np.random.RandomState(1))
+        print "{0} samples, {1} queries, k={2}".format(size, len(queries), args.k)
+        exact = run('exact', neighbors.ExactIndex, samples, responses,
+                    queries, args.k, args.classes)
+        cluster = run('cluster', neighbors.ClusterIndex, samples, responses,
+                      queries, args.k, args.classes, recall=args.recall)
+        print "  cluster agrees with exact on {0:.2f} % of the queries".format(
+            np.mean(cluster == exact) * 100)
+        if not args.no_opencv:
+            opencv = run('opencv', neighbors.OpenCVIndex, samples, responses,
+                         queries, args.k, args.classes)
+            print "  opencv agrees with exact on {0:.2f} % of the queries".format(
+                np.mean(opencv.ravel() == exact) * 100)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# page.py
+#
+# Author: Yann KOETH
+# Created: Tue Dec  2 15:31:26 2014 (+0100)
+# Last-Updated: Tue Dec  2 17:02:45 2014 (+0100)
+#           By: Yann KOETH
+#     Update #: 29
+#
+
+"""Measure OCR.recognizePage throughput in glyphs per second.
+
+    python benchmarks/page.py --lines 60 --model knn
+"""
+
+import argparse
+import os
+import random
+import shutil
+import string
+import sys
+import tempfile
+import timeit
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mediocre.classes import Class
+from mediocre.dataset import Dataset
+from mediocre.ocr import OCR
+
+FONT = cv2.FONT_HERSHEY_SIMPLEX
+MODELS = {'ann': OCR.MODEL_ANN, 'knn': OCR.MODEL_KNN, 'svm': OCR.MODEL_SVM}
+
+
+def renderDataset(folder, classes, count, rand):
+    """Write count jittered renderings of every class.
+    """
+    for cl in classes:
+        path = os.path.join(folder, cl.folder)
+        os.makedirs(path)
+        for i in xrange(count):
+            image = np.full((60, 60), 255, np.uint8)
+            scale = rand.uniform(1.2, 1.8)
+            cv2.putText(image, cl.value, (rand.randint(5, 15), rand.randint(40, 50)),
+                        FONT, scale, 0, rand.randint(2, 4))
+            cv2.imwrite(os.path.join(path, "{0}.{1}.bmp".format(cl.folder, i)), image)
+
+
+def renderPage(lines, width, rand):
+    text = []
+    for i in xrange(lines):
+        words = [''.join(rand.choice(string.ascii_letters + string.digits)
+                         for j in xrange(rand.randint(2, 8)))
+                 for k in xrange(width)]
+        text.append(' '.join(words))
+    page = np.full((40 + lines * 50, 40 + width * 180), 255, np.uint8)
+    for i, line in enumerate(text):
+        cv2.putText(page, line, (20, 50 + i * 50), FONT, 1, 0, 2)
+    return page, text
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lines', type=int, default=60)
+    parser.add_argument('--words', type=int, default=10, help="words per line")
+    parser.add_argument('--model', choices=sorted(MODELS), default='knn')
+    parser.add_argument('--samples', type=int, default=40, help="per class")
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    rand = random.Random(0)
+    classes = [Class(c, c, "c{0}".format(ord(c)))
+               for c in string.ascii_letters + string.digits]
+    folder = tempfile.mkdtemp()
+    try:
+        renderDataset(folder, classes, args.samples, rand)
+        ocr = OCR()
+        ocr.trainModel(Dataset(folder), classes, MODELS[args.model], 1.,
+                       args.samples, workers=args.workers)
+    finally:
+        shutil.rmtree(folder)
+
+    page, text = renderPage(args.lines, args.words, rand)
+    best = None
+    for i in xrange(args.repeat):
+        start = timeit.default_timer()
+        result = ocr.recognizePage(page, args.workers)
+        elapsed = timeit.default_timer() - start
+        best = elapsed if best is None else min(best, elapsed)
+    glyphs = len(result.glyphs)
+    expected = sum(len(line.replace(' ', '')) for line in text)
+    print "{0} glyphs found ({1} expected) in {2} lines ({3} expected)".format(
+        glyphs, expected, len(result.lines), len(text))
+    print "{0:.3f} s, {1:.0f} glyphs/s".format(best, glyphs / best)
+    found = result.text.split('\n')
+    if len(found) == len(text):
+        hits = sum(a == b for f, t in zip(found, text)
+                   for a, b in zip(f.replace(' ', ''), t.replace(' ', '')))
+        print "character accuracy: {0:.2f} %".format(hits * 100. / expected)
+
+
+if __name__ == '__main__':
+    main()
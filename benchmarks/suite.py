@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# suite.py
+#
+# Author: Yann KOETH
+# Created: Fri Dec  5 14:21:09 2014 (+0100)
+# Last-Updated: Fri Dec  5 17:02:44 2014 (+0100)
+#           By: Yann KOETH
+#     Update #: 58
+#
+
+"""Pre-processing, training and prediction benchmarks on synthetic glyphs.
+
+    python benchmarks/suite.py run --output before.json
+    python benchmarks/suite.py run --output after.json
+    python benchmarks/suite.py compare before.json after.json
+
+The glyphs only depend on the seed, so runs are comparable. compare
+exits with an error when a metric regressed by more than the threshold.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import string
+import sys
+import timeit
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mediocre import models
+from mediocre.ocr import OCR
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+FONTS = [cv2.FONT_HERSHEY_SIMPLEX, cv2.FONT_HERSHEY_DUPLEX,
+         cv2.FONT_HERSHEY_COMPLEX, cv2.FONT_HERSHEY_TRIPLEX]
+MODELS = OrderedDict([('ann', OCR.MODEL_ANN),
+                      ('knn', OCR.MODEL_KNN),
+                      ('svm', OCR.MODEL_SVM)])
+SIZE = 60
+
+
+def syntheticGlyphs(chars, count, rand):
+    """count jittered BGR renderings of every character.
+    Returns the (N, SIZE, SIZE, 3) images and their responses.
+    """
+    images = np.full((len(chars) * count, SIZE, SIZE, 3), 255, np.uint8)
+    responses = np.repeat(np.arange(len(chars)), count)
+    for image, response in zip(images, responses):
+        cv2.putText(image, chars[response],
+                    (rand.randint(5, 16), rand.randint(40, 51)),
+                    FONTS[rand.randint(len(FONTS))], rand.uniform(1.2, 1.8),
+                    (0, 0, 0), rand.randint(2, 5))
+        rotation = cv2.getRotationMatrix2D((SIZE / 2, SIZE / 2),
+                                           rand.uniform(-10, 10), 1)
+        image[:] = cv2.warpAffine(image, rotation, (SIZE, SIZE),
+                                  borderValue=(255, 255, 255))
+    noise = rand.randint(-20, 21, images.shape)
+    images[:] = np.clip(images + noise, 0, 255)
+    return images, responses
+
+
+def peakMemory():
+    """Peak resident memory of the process in MB, None if unknown.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return peak / (1024. * 1024.)
+    return peak / 1024.
+
+
+def best(func, repeat):
+    """Shortest of repeat runs of func, in seconds.
+    """
+    times = []
+    for i in xrange(repeat):
+        start = timeit.default_timer()
+        func()
+        times.append(timeit.default_timer() - start)
+    return min(times)
+
+
+class Results(object):
+    """Metrics as {name: {'value': v, 'unit': u, 'better': 'lower' or 'higher'}}.
+    """
+
+    def __init__(self):
+        self.metrics = OrderedDict()
+
+    def add(self, name, value, unit, better='lower'):
+        if value is None:
+            return
+        self.metrics[name] = OrderedDict([('value', float(value)), ('unit', unit),
+                                          ('better', better)])
+        print "  {0:<40}{1:>14.4f} {2}".format(name, value, unit)
+
+
+def benchPreprocess(results, name, model, images, repeat):
+    latencies = np.empty((repeat, len(images)))
+    for i in xrange(repeat):
+        for j, image in enumerate(images):
+            start = timeit.default_timer()
+            model.preprocess(image)
+            latencies[i, j] = timeit.default_timer() - start
+    latencies = latencies.min(axis=0) * 1000
+    results.add("preprocess.{0}.mean".format(name), latencies.mean(), "ms")
+    results.add("preprocess.{0}.p95".format(name), np.percentile(latencies, 95), "ms")
+    elapsed = best(lambda: model.features(np.array([model.glyph(image)
+                                                    for image in images])), repeat)
+    results.add("preprocess.{0}.batch".format(name), len(images) / elapsed,
+                "images/s", 'higher')
+
+
+def benchModel(results, name, Model, nClass, trainImages, trainResponses,
+               testImages, repeat, single):
+    baseline = peakMemory()
+    model = Model(nClass)
+    samples = model.features(np.array([model.glyph(image) for image in trainImages]))
+    queries = model.features(np.array([model.glyph(image) for image in testImages]))
+    start = timeit.default_timer()
+    model.train(samples, trainResponses)
+    results.add("train.{0}".format(name), timeit.default_timer() - start, "s")
+    # The first prediction pays for anything the model builds lazily.
+    start = timeit.default_timer()
+    model.predict(queries)
+    results.add("predict.{0}.first".format(name), timeit.default_timer() - start, "s")
+    elapsed = best(lambda: model.predict(queries), repeat)
+    results.add("predict.{0}.batch".format(name), len(queries) / elapsed,
+                "samples/s", 'higher')
+    single = queries[:single]
+    elapsed = best(lambda: [model.predict(sample[np.newaxis]) for sample in single],
+                   repeat)
+    results.add("predict.{0}.single".format(name), len(single) / elapsed,
+                "samples/s", 'higher')
+    if baseline is not None:
+        results.add("memory.{0}.peak".format(name), peakMemory() - baseline, "MB")
+
+
+def _benchModel(*args):
+    results = Results()
+    benchModel(results, *args)
+    sys.stdout.flush()
+    return results.metrics
+
+
+def benchModelProcess(results, *args):
+    """Run benchModel in a process of its own: the peak memory of a
+    process only grows, a model must not inherit the peak of another.
+    Its memory is measured over the baseline of the fresh process.
+    """
+    pool = multiprocessing.Pool(1)
+    try:
+        results.metrics.update(pool.apply(_benchModel, args))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def run(args):
+    rand = np.random.RandomState(args.seed)
+    chars = string.digits + string.ascii_letters
+    trainImages, trainResponses = syntheticGlyphs(chars, args.samples, rand)
+    testImages, testResponses = syntheticGlyphs(chars, args.tests, rand)
+    print "{0} train and {1} test glyphs of {2} classes".format(
+        len(trainImages), len(testImages), len(chars))
+
+    results = Results()
+    benchPreprocess(results, "StatModel", models.StatModel(len(chars)),
+                    testImages, args.repeat)
+    benchPreprocess(results, "SVM", models.SVM(len(chars)), testImages, args.repeat)
+    for name in args.model:
+        benchModelProcess(results, name.upper(), OCR.MODELS[MODELS[name]], len(chars),
+                          trainImages, trainResponses, testImages, args.repeat,
+                          args.single)
+    results.add("memory.peak", peakMemory(), "MB")
+
+    if args.output:
+        report = OrderedDict([
+            ('meta', OrderedDict([('python', platform.python_version()),
+                                  ('numpy', np.__version__),
+                                  ('opencv', cv2.__version__),
+                                  ('machine', platform.machine()),
+                                  ('seed', args.seed),
+                                  ('samples', args.samples),
+                                  ('tests', args.tests)])),
+            ('metrics', results.metrics)])
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+
+
+def compare(args):
+    with open(args.before) as file:
+        before = json.load(file, object_pairs_hook=OrderedDict)['metrics']
+    with open(args.after) as file:
+        after = json.load(file)['metrics']
+    regressions = []
+    print "  {0:<40}{1:>14}{2:>14}{3:>10}".format("Metric", "Before", "After", "Change")
+    for name, old in before.items():
+        if name not in after or not old['value']:
+            continue
+        new = after[name]
+        change = new['value'] / old['value'] - 1
+        worse = change if old['better'] == 'lower' else -change
+        flag = ''
+        if worse > args.threshold:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print "  {0:<40}{1:>14.4f}{2:>14.4f}{3:>9.1f}%{4}".format(
+            name, old['value'], new['value'], change * 100, flag)
+    if regressions:
+        print "{0} regression(s) over {1:.0f} %".format(len(regressions),
+                                                       args.threshold * 100)
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers()
+
+    sub = subparsers.add_parser('run', help="run the benchmarks")
+    sub.add_argument('--output', help="JSON results file")
+    sub.add_argument('--model', nargs='+', choices=list(MODELS), default=list(MODELS))
+    sub.add_argument('--samples', type=int, default=20, help="train glyphs per class")
+    sub.add_argument('--tests', type=int, default=10, help="test glyphs per class")
+    sub.add_argument('--single', type=int, default=200,
+                     help="samples predicted one at a time")
+    sub.add_argument('--repeat', type=int, default=3)
+    sub.add_argument('--seed', type=int, default=0)
+    sub.set_defaults(func=run)
+
+    sub = subparsers.add_parser('compare', help="compare two results files")
+    sub.add_argument('before')
+    sub.add_argument('after')
+    sub.add_argument('--threshold', type=float, default=.1,
+                     help="relative change flagged as a regression")
+    sub.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,16 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# __main__.py
+#
+# Author: Yann KOETH
+# Created: Wed Dec  3 10:20:02 2014 (+0100)
+# Last-Updated: Wed Dec  3 10:21:37 2014 (+0100)
+#           By: Yann KOETH
+#     Update #: 3
+#
+
+import sys
+
+from mediocre.cli import main
+
+sys.exit(main())
@@ -10,17 +10,57 @@
 #
 
 import timeit
-from collections import Counter, defaultdict
+from contextlib import closing
 
 import numpy as np
 
+from mediocre import profiling
+
+
+def confusionMatrix(responses, predict, nClass):
+    """Count of samples of class i predicted as class j at [i, j].
+    """
+    index = np.int64(responses) * nClass + np.int64(predict)
+    return np.bincount(index.ravel(), minlength=nClass * nClass).reshape(nClass, nClass)
+
+
+def scores(matrix):
+    """Per-class (precision, recall, f1) of a confusion matrix.
+    Classes without predictions or samples score 0.
+    """
+    hits = np.float64(np.diag(matrix))
+    predicted, actual = matrix.sum(axis=0), matrix.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        precision = np.where(predicted > 0, hits / predicted, 0)
+        recall = np.where(actual > 0, hits / actual, 0)
+        f1 = np.where(precision + recall > 0,
+                      2 * precision * recall / (precision + recall), 0)
+    return precision, recall, f1
+
+
+def mostConfused(matrix, count=5):
+    """The count most frequent errors, as (class, predicted, samples).
+    """
+    errors = matrix.copy()
+    np.fill_diagonal(errors, 0)
+    flat = errors.ravel()
+    best = np.argsort(flat, kind='mergesort')[::-1][:count]
+    best = best[flat[best] > 0]
+    nClass = len(matrix)
+    return [(i // nClass, i % nClass, flat[i]) for i in best]
+
 
 class Analyzer(object):
+    CONFUSED_COUNT = 5
 
-    def __init__(self, model, dataset, trainRatio):
+    def __init__(self, model, dataset, trainRatio, testBatches=None):
+        """testBatches(), for a streamed dataset, returns the iterator
+        of the test (samples, responses) batches.
+        """
         self.__model = model
         self.__dataset = dataset
         self.__trainRatio = trainRatio
+        self.__testBatches = testBatches
         self.__start = 0
         self.__elapsed = 0
         self.trainMedian = 0
@@ -29,6 +69,8 @@ class Analyzer(object):
         self.trainVar = 0
         self.trainStd = 0
         self.trainVarCoeff = 0
+        self.trainMatrix = None
+        self.testMatrix = None
 
     def start(self):
         self.__start = timeit.default_timer()
@@ -37,72 +79,131 @@ class Analyzer(object):
         self.__elapsed = timeit.default_timer() - self.__start
 
     def __str__(self):
-        res = "\tTrain samples\t\tTest samples"
-        for cl, ((tTrain, nTrain, pTrain), (tTest, nTest, pTest)) in sorted(self.classifications.items()):
-            res += "\n  {0}:\t{1} / {2}\t({3} %)\t  -  {4} / {5}\t({6} %)".format(cl.repr, tTrain, nTrain, pTrain, tTest, nTest, pTest)
-        cl, percent = self.maxTrain
-        res += "\n\n  Best recognized in train set : %s (%d %%)\n" % (cl.repr, percent)
-        cl, percent = self.minTrain
-        res += "  Worst recognized in train set : %s (%d %%)\n" % (cl.repr, percent)
-        cl, percent = self.maxTest
-        res += "\n  Best recognized in test set : %s (%d %%)\n" % (cl.repr, percent)
-        cl, percent = self.minTest
-        res += "  Worst recognized in test set : %s (%d %%)\n" % (cl.repr, percent)
-        res += '\n ------------------\n'
-        res += '| Training samples |\n'
-        res += ' ------------------\n'
-        res += "  Mean : %d\n" % self.trainMean
-        res += "  Median : %d\n" % self.trainMedian
-        res += "  Median absolute deviation : %.2f\n" % self.trainMAD
-        res += "  Standard deviation : %.2f\n" % self.trainStd
-        res += "  Coefficient of variation : %.2f %%\n" % self.trainVarCoeff
+        hasTrain, hasTest = self.trainMatrix is not None, self.testMatrix is not None
+        columns = []
+        if hasTrain:
+            columns.append("Train samples\t")
+        if hasTest:
+            columns.append("Test samples\t")
+        res = "\t" + "\t".join(columns) + "Precision\tRecall\tF1"
+        for cl, (train, test) in sorted(self.classifications.items()):
+            cells = []
+            if hasTrain:
+                cells.append("{0} / {1}\t({2} %)".format(*train))
+            if hasTest:
+                cells.append("{0} / {1}\t({2} %)".format(*test))
+            precision, recall, f1 = self.scores[cl]
+            res += "\n  {0}:\t{1}\t{2:.2f}\t\t{3:.2f}\t{4:.2f}".format(
+                cl.repr, "\t  -  ".join(cells), precision, recall, f1)
+        res += "\n"
+        if hasTrain:
+            cl, percent = self.maxTrain
+            res += "\n  Best recognized in train set : %s (%d %%)\n" % (cl.repr, percent)
+            cl, percent = self.minTrain
+            res += "  Worst recognized in train set : %s (%d %%)\n" % (cl.repr, percent)
+        if hasTest:
+            cl, percent = self.maxTest
+            res += "\n  Best recognized in test set : %s (%d %%)\n" % (cl.repr, percent)
+            cl, percent = self.minTest
+            res += "  Worst recognized in test set : %s (%d %%)\n" % (cl.repr, percent)
+        if self.confused:
+            res += "\n  Most confused :\n"
+            for cl, predicted, count in self.confused:
+                res += "    %s taken for %s : %d\n" % (cl.repr, predicted.repr, count)
+        if hasTrain:
+            res += '\n ------------------\n'
+            res += '| Training samples |\n'
+            res += ' ------------------\n'
+            res += "  Mean : %d\n" % self.trainMean
+            res += "  Median : %d\n" % self.trainMedian
+            res += "  Median absolute deviation : %.2f\n" % self.trainMAD
+            res += "  Standard deviation : %.2f\n" % self.trainStd
+            res += "  Coefficient of variation : %.2f %%\n" % self.trainVarCoeff
 
         res += '\nTrain set: %d samples | Test set: %d samples\n' % (self.trainCount, self.testCount)
-        res += 'Training time: %.4f s\n' % self.__elapsed
-        res += '\nTrain accuracy: %.2f %% | Test accuracy %.2f %%\n' % (self.trainRate * 100, self.testRate * 100)
+        if self.trainCount:
+            res += 'Training time: %.4f s\n' % self.__elapsed
+        rates = []
+        if hasTrain:
+            rates.append('Train accuracy: %.2f %%' % (self.trainRate * 100))
+        if hasTest:
+            rates.append('Test accuracy: %.2f %%' % (self.testRate * 100))
+        res += '\n' + ' | '.join(rates) + '\n'
+        if profiling.enabled():
+            res += profiling.report()
         return res
 
-    def __mapDict(self, dict, func):
-        res = func(dict, key=dict.get)
-        return (res, dict[res])
-
     def analyze(self):
         """Analyze dataset repartition and model performance.
         """
+        classes = self.__dataset.classes
+        nClass = len(classes)
         self.trainCount = self.__dataset.trainSampleCount
         self.testCount = self.__dataset.testSampleCount
-        trainSamples, trainResponses = self.__dataset.trainSamples, self.__dataset.trainResponses
-        testSamples, testResponses = self.__dataset.testSamples, self.__dataset.testResponses
-
-        truthTableTrain, self.trainRate = (defaultdict(int), 0)
-        truthTableTest, self.testRate = (defaultdict(int), 0)
-
-        if 0 < self.__trainRatio:
-            truthTableTrain, self.trainRate = self.__analyzePredict(trainSamples, trainResponses)
-        if 0 < self.__trainRatio < 1 and testSamples.any():
-            truthTableTest, self.testRate = self.__analyzePredict(testSamples, testResponses)
-        countTrain = Counter([self.__dataset.getResponse(i) for i in trainResponses])
-        countTest = Counter([self.__dataset.getResponse(i) for i in testResponses])
+        trainResponses = self.__dataset.trainResponses
+        testResponses = self.__dataset.testResponses
+        countTrain = np.bincount(np.int64(trainResponses), minlength=nClass)
+        countTest = np.bincount(np.int64(testResponses), minlength=nClass)
+
+        self.trainMatrix, self.trainRate = None, 0
+        self.testMatrix, self.testRate = None, 0
+        # A streamed train set is not in memory, it is not analyzed.
+        if 0 < self.__trainRatio and len(self.__dataset.trainSamples):
+            self.trainMatrix = self.__analyzePredict(self.__dataset.trainSamples,
+                                                     trainResponses, nClass)
+            self.trainRate = np.trace(self.trainMatrix) / float(self.trainCount)
+        if self.__trainRatio < 1 and self.testCount:
+            if self.__testBatches:
+                self.testMatrix = self.__analyzeBatches(nClass)
+            else:
+                self.testMatrix = self.__analyzePredict(self.__dataset.testSamples,
+                                                        testResponses, nClass)
+            self.testRate = np.trace(self.testMatrix) / float(self.testCount)
 
         # Create a dict {label1: (train, test), label2: ...}
         # where train = (wellPredicted, total, percentage)
         # and test = (wellPredicted, total, percentage)
-        trainPercents, testPercents = {}, {}
-        self.classifications = {}
-        for k in list(set(countTrain.keys()) | set(countTest.keys())):
-            trainPercents[k] = int(truthTableTrain[k] / float(countTrain[k]) * 100) if countTrain[k] > 0 else 100
-            testPercents[k] = int(truthTableTest[k] / float(countTest[k]) * 100) if countTest[k] > 0 else 100
-            self.classifications[k] = ((truthTableTrain[k], countTrain[k], trainPercents[k]),
-                                       (truthTableTest[k], countTest[k], testPercents[k]))
-
-        self.minTrain, self.maxTrain = self.__mapDict(trainPercents, min), self.__mapDict(trainPercents, max)
-        self.minTest, self.maxTest = self.__mapDict(testPercents, min), self.__mapDict(testPercents, max)
-        self.__analyzeTrainingSamples([v for k, v in countTrain.iteritems()])
+        trainHits = self.__hits(self.trainMatrix, nClass)
+        testHits = self.__hits(self.testMatrix, nClass)
+        trainPercents = self.__percents(trainHits, countTrain)
+        testPercents = self.__percents(testHits, countTest)
+        matrix = self.testMatrix if self.testMatrix is not None else self.trainMatrix
+        if matrix is None:
+            matrix = np.zeros((nClass, nClass), np.int64)
+        precision, recall, f1 = scores(matrix)
+        self.classifications, self.scores = {}, {}
+        present = np.flatnonzero(countTrain + countTest)
+        for i in present:
+            cl = classes[i]
+            self.classifications[cl] = ((trainHits[i], countTrain[i], trainPercents[i]),
+                                        (testHits[i], countTest[i], testPercents[i]))
+            self.scores[cl] = (precision[i], recall[i], f1[i])
+        self.confused = [(classes[i], classes[j], count) for i, j, count
+                         in mostConfused(matrix, self.CONFUSED_COUNT)]
+
+        if len(present):
+            self.minTrain, self.maxTrain = self.__extrema(classes, present, trainPercents)
+            self.minTest, self.maxTest = self.__extrema(classes, present, testPercents)
+        self.__analyzeTrainingSamples(countTrain[countTrain > 0])
+
+    def __hits(self, matrix, nClass):
+        if matrix is None:
+            return np.zeros(nClass, np.int64)
+        return np.diag(matrix)
+
+    def __percents(self, hits, counts):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(counts > 0, np.int64(hits * 100. / counts), 100)
+
+    def __extrema(self, classes, present, percents):
+        values = percents[present]
+        return ((classes[present[values.argmin()]], values.min()),
+                (classes[present[values.argmax()]], values.max()))
 
     def __analyzeTrainingSamples(self, trainingSamples):
         """Analyze training samples distribution.
         """
-        if trainingSamples:
+        if len(trainingSamples):
             self.trainMedian = np.median(trainingSamples)
             self.trainMean = np.mean(trainingSamples)
             self.trainMAD = np.median(np.absolute(trainingSamples - self.trainMedian))
@@ -111,12 +212,16 @@ class Analyzer(object):
             if np.mean(trainingSamples) > 0:
                 self.trainVarCoeff = (self.trainStd / self.trainMean * 100)
 
-    def __analyzePredict(self, samples, responses):
-        """Analyze the rate of true predictions.
+    def __analyzeBatches(self, nClass):
+        """Confusion matrix accumulated over the test batches.
+        """
+        matrix = np.zeros((nClass, nClass), np.int64)
+        with closing(self.__testBatches()) as batches:
+            for samples, responses in batches:
+                matrix += self.__analyzePredict(samples, responses, nClass)
+        return matrix
+
+    def __analyzePredict(self, samples, responses, nClass):
+        """Confusion matrix of the model predictions.
         """
-        predict = self.__model.predict(samples)
-        trueTable = (predict == responses)
-        truePredict = Counter([self.__dataset.getResponse(c) for i, c
-                               in enumerate(predict) if trueTable[i]])
-        rate = np.mean(predict == responses)
-        return truePredict, rate
+        return confusionMatrix(responses, self.__model.predict(samples), nClass)
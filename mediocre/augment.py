@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# augment.py
+#
+# Author: Yann KOETH
+# Created: Sun Dec  7 10:03:26 2014 (+0100)
+# Last-Updated: Sun Dec  7 14:48:11 2014 (+0100)
+#           By: Yann KOETH
+#     Update #: 87
+#
+
+"""Random variants of hand drawn glyphs, rendered without Qt.
+
+The strokes are rasterized once per pen width, then every variant is
+a perspective warp of one of these rasters, as the QGraphicsRotation
+around the X, Y and Z axes of the former Qt rendering.
+
+Stored glyph images can also be augmented on the fly, as a stream of
+feature batches that never touches the disk.
+"""
+
+import cv2
+import numpy as np
+
+from mediocre import pack
+from mediocre.parallel import processImap, processMap
+
+# Distance of the projection plane, as in QTransform.rotate.
+DISTANCE = 1024.
+SUPERSAMPLING = 2
+BATCH_SIZE = 256
+
+_rasters = {}
+
+
+class AugmentParam(object):
+    """Variants of stored images: factor variants per image, strokes
+    thickened by minThick to maxThick pixels (negative values thin
+    them) and rotated by up to xAngle, yAngle and zAngle degrees.
+    """
+
+    def __init__(self, factor=4, minThick=-1, maxThick=1,
+                 xAngle=40, yAngle=30, zAngle=10):
+        self.factor = factor
+        self.minThick = minThick
+        self.maxThick = maxThick
+        self.xAngle = xAngle
+        self.yAngle = yAngle
+        self.zAngle = zAngle
+
+
+def canvasTransform(canvas, width, height):
+    """Scale and center canvas (x, y, w, h) in a width x height image,
+    keeping its aspect ratio, as QGraphicsScene.render does.
+    """
+    x, y, w, h = canvas
+    scale = min(width / float(w), height / float(h))
+    return np.array([[scale, 0, (width - w * scale) / 2. - x * scale],
+                     [0, scale, (height - h * scale) / 2. - y * scale],
+                     [0, 0, 1]])
+
+
+def rotation(center, xAngle, yAngle, zAngle):
+    """Homography rotating around center by angles in degrees,
+    the X and Y axis rotations being projected as Qt does.
+    """
+    ax, ay, az = np.radians([xAngle, yAngle, zAngle])
+    rx = np.array([[1, 0, 0],
+                   [0, np.cos(ax), 0],
+                   [0, -np.sin(ax) / DISTANCE, 1]])
+    ry = np.array([[np.cos(ay), 0, 0],
+                   [0, 1, 0],
+                   [-np.sin(ay) / DISTANCE, 0, 1]])
+    rz = np.array([[np.cos(az), -np.sin(az), 0],
+                   [np.sin(az), np.cos(az), 0],
+                   [0, 0, 1]])
+    cx, cy = center
+    translate = np.array([[1, 0, cx], [0, 1, cy], [0, 0, 1]])
+    back = np.array([[1, 0, -cx], [0, 1, -cy], [0, 0, 1]])
+    return translate.dot(rz).dot(ry).dot(rx).dot(back)
+
+
+def rasterize(lines, transform, width, height, thickness):
+    """Draw the lines ((x1, y1), (x2, y2)) in white on black, through
+    transform, at SUPERSAMPLING times the width x height resolution.
+    """
+    shift = 4
+    scale = SUPERSAMPLING * (1 << shift)
+    raster = np.zeros((height * SUPERSAMPLING, width * SUPERSAMPLING), np.uint8)
+    for start, end in lines:
+        points = transform.dot([[start[0], end[0]], [start[1], end[1]], [1, 1]])
+        p1, p2 = [tuple(int(round(v * scale)) for v in point[:2])
+                  for point in points.T]
+        cv2.line(raster, p1, p2, 255, thickness * SUPERSAMPLING, cv2.CV_AA, shift)
+    return raster
+
+
+def _initWorker(rasters):
+    _rasters.clear()
+    _rasters.update(rasters)
+
+
+def _warpBatch(job):
+    """Warp the rasters of a batch of variants to black on white images.
+    """
+    thicknesses, homographies, width, height = job
+    size = (width * SUPERSAMPLING, height * SUPERSAMPLING)
+    images = np.empty((len(thicknesses), height, width), np.uint8)
+    for i, (thickness, homography) in enumerate(zip(thicknesses, homographies)):
+        warped = cv2.warpPerspective(_rasters[thickness], homography, size,
+                                     flags=cv2.INTER_LINEAR, borderValue=0)
+        images[i] = 255 - cv2.resize(warped, (width, height),
+                                     interpolation=cv2.INTER_AREA)
+    return images
+
+
+def generate(canvas, lines, params, seed=None, workers=1):
+    """Render params.count random variants of lines, drawn on the
+    canvas (x, y, w, h), with the thickness and rotation ranges of
+    params (a RandomParam). Batches of variants are warped by a pool
+    of processes. Returns a (count, height, width) uint8 array.
+    """
+    width, height = params.width, params.height
+    if not lines or not params.count:
+        return np.full((params.count, height, width), 255, np.uint8)
+    rand = np.random.RandomState(seed)
+    thicknesses = rand.randint(params.minThick, params.maxThick + 1, params.count)
+    angles = rand.uniform(-1, 1, (params.count, 3))
+    angles *= [params.xAngle, params.yAngle, params.zAngle]
+
+    transform = canvasTransform(canvas, width, height)
+    points = np.array([point for line in lines for point in line], np.float64)
+    center = (points.min(axis=0) + points.max(axis=0)) / 2
+    # Scene to supersampled raster, and back.
+    toRaster = np.diag([SUPERSAMPLING, SUPERSAMPLING, 1]).dot(transform)
+    toScene = np.linalg.inv(toRaster)
+    rasters = dict((thickness, rasterize(lines, transform, width, height,
+                                         max(1, int(round(thickness * transform[0, 0])))))
+                   for thickness in np.unique(thicknesses))
+    homographies = [toRaster.dot(rotation(center, *angle)).dot(toScene)
+                    for angle in angles]
+
+    jobs = [(thicknesses[start:start + BATCH_SIZE],
+             homographies[start:start + BATCH_SIZE], width, height)
+            for start in xrange(0, params.count, BATCH_SIZE)]
+    batches = processMap(_warpBatch, jobs, workers, _initWorker, (rasters,))
+    _rasters.clear()
+    return np.concatenate(batches)
+
+
+def warpImage(gray, param, rand):
+    """Returns param.factor variants of a black on white grayscale image.
+    """
+    height, width = gray.shape
+    ink = 255 - gray
+    variants = np.empty((param.factor, height, width), np.uint8)
+    for i in xrange(param.factor):
+        thickness = rand.randint(param.minThick, param.maxThick + 1)
+        strokes = ink
+        if thickness:
+            kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE,
+                                               (2 * abs(thickness) + 1,) * 2)
+            morph = cv2.dilate if thickness > 0 else cv2.erode
+            strokes = morph(ink, kernel)
+        angles = rand.uniform(-1, 1, 3) * [param.xAngle, param.yAngle, param.zAngle]
+        homography = rotation((width / 2., height / 2.), *angles)
+        variants[i] = 255 - cv2.warpPerspective(strokes, homography, (width, height),
+                                                flags=cv2.INTER_LINEAR, borderValue=0)
+    return variants
+
+
+def _augmentBatch(job):
+    """Features of the variants of a batch of image files.
+    """
+    Model, nClass, filenames, responses, param, seed = job
+    model = Model(nClass)
+    rand = np.random.RandomState(seed)
+    glyphs = [model.glyph(variant) for filename in filenames
+              for variant in warpImage(model.grayscale(pack.readImage(model, filename)),
+                                       param, rand)]
+    return model.features(np.array(glyphs)), np.repeat(responses, param.factor)
+
+
+def stream(filenames, responses, model, param, seed=None, workers=1,
+           batchSize=BATCH_SIZE):
+    """Yield (samples, responses) batches of features of param.factor
+    variants of every image file, pre-processed by model's pipeline.
+    Batches are made by a pool of processes, each from batchSize
+    files, and only depend on the seed.
+    """
+    rand = np.random.RandomState(seed)
+    jobs = [(type(model), model.classificationCount,
+             filenames[start:start + batchSize], responses[start:start + batchSize],
+             param, rand.randint(2 ** 31))
+            for start in xrange(0, len(filenames), batchSize)]
+    return processImap(_augmentBatch, jobs, workers)
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# buffer.py
+#
+# Author: Yann KOETH
+# Created: Thu Dec  4 09:12:37 2014 (+0100)
+# Last-Updated: Thu Dec  4 10:41:02 2014 (+0100)
+#           By: Yann KOETH
+#     Update #: 33
+#
+
+import numpy as np
+
+
+def rebatch(batches, size):
+    """Regroup a generator of (samples, responses) batches into batches
+    of size samples, the last one excepted. Closing the result closes
+    batches.
+    """
+    samples, responses, count = [], [], 0
+    try:
+        for batch in batches:
+            samples.append(batch[0])
+            responses.append(batch[1])
+            count += len(batch[0])
+            while count >= size:
+                allSamples, allResponses = np.concatenate(samples), np.concatenate(responses)
+                yield allSamples[:size], allResponses[:size]
+                samples, responses = [allSamples[size:]], [allResponses[size:]]
+                count -= size
+        if count:
+            yield np.concatenate(samples), np.concatenate(responses)
+    finally:
+        batches.close()
+
+
+class SampleBuffer(object):
+    """Samples and their responses, in arrays that grow by doubling.
+    Appending n rows costs O(n) amortized, instead of copying
+    everything as np.vstack does. A known final size can be given as
+    capacity to allocate it once.
+    """
+    MIN_CAPACITY = 1024
+
+    def __init__(self, samples, responses, capacity=None):
+        samples, responses = np.asarray(samples), np.asarray(responses)
+        self._count = len(samples)
+        if capacity is None:
+            capacity = max(self.MIN_CAPACITY, 2 * self._count)
+        capacity = max(capacity, self._count)
+        self._samples = self.__allocate(samples, capacity)
+        self._responses = self.__allocate(responses, capacity)
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def samples(self):
+        return self._samples[:self._count]
+
+    @property
+    def responses(self):
+        return self._responses[:self._count]
+
+    def __allocate(self, array, capacity):
+        buffer = np.empty((capacity,) + array.shape[1:], array.dtype)
+        buffer[:len(array)] = array
+        return buffer
+
+    def append(self, samples, responses):
+        count = self._count + len(samples)
+        if count > len(self._samples):
+            capacity = max(count, 2 * len(self._samples))
+            self._samples = self.__allocate(self.samples, capacity)
+            self._responses = self.__allocate(self.responses, capacity)
+        self._samples[self._count:count] = samples
+        self._responses[self._count:count] = responses
+        self._count = count
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# cache.py
+#
+# Author: Yann KOETH
+# Created: Fri Nov 28 10:12:41 2014 (+0100)
+# Last-Updated: Fri Nov 28 11:47:03 2014 (+0100)
+#           By: Yann KOETH
+#     Update #: 37
+#
+
+import hashlib
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+
+class FeatureCache(object):
+    """On-disk cache of pre-processed samples.
+    Entries are keyed by file path, size, modification time, or by
+    the content hash of the file when it is known, and the
+    fingerprint of the pre-processing pipeline.
+    """
+    MAX_SIZE = 512 * 1024 * 1024
+    EXT = ".npy"
+
+    def __init__(self, folder, maxSize=MAX_SIZE):
+        self._folder = folder
+        self._maxSize = maxSize
+
+    def folder(self):
+        return self._folder
+
+    def __entryPath(self, filename, fingerprint, digest=None):
+        if digest is None:
+            stat = os.stat(filename)
+            key = "{0}:{1}:{2!r}".format(os.path.abspath(filename),
+                                         stat.st_size, stat.st_mtime)
+            digest = hashlib.md5(key).hexdigest()
+        return os.path.join(self._folder, fingerprint, digest + self.EXT)
+
+    def get(self, filename, fingerprint, digest=None):
+        """Returns the cached sample or None.
+        """
+        path = self.__entryPath(filename, fingerprint, digest)
+        try:
+            sample = np.load(path)
+        except (IOError, ValueError):
+            return None
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return sample
+
+    def put(self, filename, fingerprint, sample, digest=None):
+        path = self.__entryPath(filename, fingerprint, digest)
+        folder = os.path.dirname(path)
+        if not os.path.exists(folder):
+            try:
+                os.makedirs(folder)
+            except OSError:
+                if not os.path.isdir(folder):
+                    raise
+        fd, tmp = tempfile.mkstemp(suffix=".tmp", dir=folder)
+        with os.fdopen(fd, 'wb') as file:
+            np.save(file, sample)
+        os.rename(tmp, path)
+
+    def prune(self):
+        """Evict least recently used entries until the cache fits in maxSize.
+        """
+        entries = []
+        for root, dirs, files in os.walk(self._folder):
+            for file in files:
+                if file.endswith(self.EXT):
+                    path = os.path.join(root, file)
+                    stat = os.stat(path)
+                    entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for mtime, size, path in entries)
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= self._maxSize:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+    def clear(self):
+        if os.path.isdir(self._folder):
+            shutil.rmtree(self._folder)
@@ -11,16 +11,6 @@
 
 import string
 
-from PyQt5.QtGui import QStandardItem, QStandardItemModel
-
-
-class TreeModel(QStandardItemModel):
-    pass
-
-
-class TreeItem(QStandardItem):
-    pass
-
 
 class Class:
     def __init__(self, value, repr, folder):
@@ -30,6 +20,10 @@ class Class:
 
 
 class Classes:
+    """Catalogue of the recognizable classes.
+    The catalogue itself does not depend on Qt, getClasses builds the
+    Qt item model shown by the classes tree view.
+    """
     ENGLISH_ALPHABET = "English Alphabet"
     UPPER = "Upper case"
     LOWER = "Lower case"
@@ -42,86 +36,113 @@ class Classes:
     SYMBOLS_PREFIX = "sym_"
     DIGITS_PREFIX = "num_"
 
-    classes = None
-
-    @staticmethod
-    def _addClass(parent, value, repr, name):
-        item = TreeItem(repr)
-        item.setData(Class(value, repr, name))
-        parent.appendRow(item)
+    PUNCTUATION_NAMES = {
+        '\'': ('apostrophe', 'apos'), ',': ('comma', 'comma'),
+        ':': ('colon', 'colon'), '-': ('hyphen', 'hyphen'),
+        '!': ('exclamation mark', 'exclmark'),
+        '"': ('quote mark', 'quotmark'), ' ': ('space', 'space'),
+        '{': ('left curly bracket', 'lcbracket'),
+        '(': ('left parenthesis', 'lparen'),
+        '[': ('left square bracket', 'lsqbracket'),
+        '.': ('point', 'point'), '?': ('question mark', 'questmark'),
+        '}': ('right curly bracket', 'rcbracket'),
+        ')': ('right parenthesis', 'rparen'),
+        ']': ('right square bracket', 'rsqbracket'),
+        ';': ('semicolon', 'scolon'), '/': ('slash', 'slash')
+    }
+    SYMBOL_NAMES = {
+        '&': ('ampersand', 'amper'),
+        '@': ('at sign', 'arob'), '`': ('back quote', 'bquote'),
+        '\\': ('backslash', 'bslash'), '^': ('caret', 'caret'),
+        '$': ('dollar', 'dollar'), '=': ('equal', 'equal'),
+        '>': ('greater than', 'gthan'),
+        '<': ('lower than', 'lthan'), '#': ('number sign', 'num'),
+        '%': ('percent', 'pcent'),
+        '|': ('pipe', 'pipe'), '+': ('plus', 'plus'),
+        '*': ('star', 'star'),
+        '~': ('tilde', 'tilde'), '_': ('underscore', 'under')
+    }
 
-    @staticmethod
-    def _addGroup(parent, name):
-        group = TreeItem(name)
-        group.setData(name)
-        parent.appendRow(group)
-        return group
+    classes = None
+    tree = None
 
     @staticmethod
-    def _addLettersClasses(model):
-        alpha = Classes._addGroup(model, Classes.ENGLISH_ALPHABET)
-        upper = Classes._addGroup(alpha, Classes.UPPER)
-        lower = Classes._addGroup(alpha, Classes.LOWER)
+    def _lettersGroup():
+        upper, lower = [], []
         for letter in list(string.ascii_lowercase):
-            Classes._addClass(lower, letter, letter,
-                              letter + Classes.LOWER_SUFFIX)
+            lower.append(Class(letter, letter, letter + Classes.LOWER_SUFFIX))
             uppercase = letter.upper()
-            Classes._addClass(upper, uppercase, uppercase, letter)
+            upper.append(Class(uppercase, uppercase, letter))
+        return (Classes.ENGLISH_ALPHABET, [(Classes.UPPER, upper),
+                                           (Classes.LOWER, lower)])
 
     @staticmethod
-    def _addDigitsClasses(model):
-        digits = Classes._addGroup(model, Classes.DIGITS)
-        for digit in list(string.digits):
-            Classes._addClass(digits, digit, digit,
-                              Classes.DIGITS_PREFIX + digit)
+    def _digitsGroup():
+        digits = [Class(digit, digit, Classes.DIGITS_PREFIX + digit)
+                  for digit in list(string.digits)]
+        return (Classes.DIGITS, digits)
 
     @staticmethod
-    def _addPunctuationClasses(model):
-        punctuation = {
-            '\'': ('apostrophe', 'apos'), ',': ('comma', 'comma'),
-            ':': ('colon', 'colon'), '-': ('hyphen', 'hyphen'),
-            '!': ('exclamation mark', 'exclmark'),
-            '"': ('quote mark', 'quotmark'), ' ': ('space', 'space'),
-            '{': ('left curly bracket', 'lcbracket'),
-            '(': ('left parenthesis', 'lparen'),
-            '[': ('left square bracket', 'lsqbracket'),
-            '.': ('point', 'point'), '?': ('question mark', 'questmark'),
-            '}': ('right curly bracket', 'rcbracket'),
-            ')': ('right parenthesis', 'rparen'),
-            ']': ('right square bracket', 'rsqbracket'),
-            ';': ('semicolon', 'scolon'), '/': ('slash', 'slash')
-        }
-        symbols = {
-            '&': ('ampersand', 'amper'),
-            '@': ('at sign', 'arob'), '`': ('back quote', 'bquote'),
-            '\\': ('backslash', 'bslash'), '^': ('caret', 'caret'),
-            '$': ('dollar', 'dollar'), '=': ('equal', 'equal'),
-            '>': ('greater than', 'gthan'),
-            '<': ('lower than', 'lthan'), '#': ('number sign', 'num'),
-            '%': ('percent', 'pcent'),
-            '|': ('pipe', 'pipe'), '+': ('plus', 'plus'),
-            '*': ('star', 'star'),
-            '~': ('tilde', 'tilde'), '_': ('underscore', 'under')
-        }
-
-        punc = Classes._addGroup(model, Classes.PUNCTUATION)
-        commonGroup = Classes._addGroup(punc, Classes.COMMON_PUNC)
-        symbolGroup = Classes._addGroup(punc, Classes.SYMBOLS)
+    def _punctuationGroup():
+        common, symbols = [], []
         for sym in list(string.punctuation + ' '):
-            is_sym, is_punc = sym in symbols, sym in punctuation
+            is_sym, is_punc = sym in Classes.SYMBOL_NAMES, sym in Classes.PUNCTUATION_NAMES
             if is_sym or is_punc:
-                repr, name = symbols[sym] if is_sym else punctuation[sym]
-                parent = commonGroup if is_punc else symbolGroup
+                names = Classes.SYMBOL_NAMES if is_sym else Classes.PUNCTUATION_NAMES
+                repr, name = names[sym]
+                group = common if is_punc else symbols
                 repr = "{0} ({1})".format(sym, repr.capitalize())
-                Classes._addClass(parent, sym, repr,
-                                  Classes.SYMBOLS_PREFIX + name)
+                group.append(Class(sym, repr, Classes.SYMBOLS_PREFIX + name))
+        return (Classes.PUNCTUATION, [(Classes.COMMON_PUNC, common),
+                                      (Classes.SYMBOLS, symbols)])
+
+    @staticmethod
+    def getTree():
+        """Returns the catalogue as a list of (name, children) groups,
+        children being either groups or Class instances.
+        """
+        if not Classes.tree:
+            Classes.tree = [Classes._lettersGroup(),
+                            Classes._digitsGroup(),
+                            Classes._punctuationGroup()]
+        return Classes.tree
+
+    @staticmethod
+    def getClassList(groups=None):
+        """Returns the classes of the named groups, or all of them.
+        """
+        def collect(children, selected):
+            classes = []
+            for child in children:
+                if isinstance(child, Class):
+                    if selected:
+                        classes.append(child)
+                else:
+                    name, grandChildren = child
+                    classes.extend(collect(grandChildren,
+                                           selected or name in groups))
+            return classes
+        return collect(Classes.getTree(), groups is None)
 
     @staticmethod
     def getClasses():
+        """Returns the catalogue as a Qt item model.
+        """
         if not Classes.classes:
-            model = TreeModel()
-            Classes._addLettersClasses(model)
-            Classes._addDigitsClasses(model)
-            Classes._addPunctuationClasses(model)
+            from PyQt5.QtGui import QStandardItem, QStandardItemModel
+
+            def addChildren(parent, children):
+                for child in children:
+                    if isinstance(child, Class):
+                        item = QStandardItem(child.repr)
+                        item.setData(child)
+                    else:
+                        name, grandChildren = child
+                        item = QStandardItem(name)
+                        item.setData(name)
+                        addChildren(item, grandChildren)
+                    parent.appendRow(item)
+            model = QStandardItemModel()
+            addChildren(model, Classes.getTree())
             Classes.classes = model
         return Classes.classes
@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# cli.py
+#
+# Author: Yann KOETH
+# Created: Wed Dec  3 10:22:48 2014 (+0100)
+# Last-Updated: Wed Dec  3 14:57:19 2014 (+0100)
+#           By: Yann KOETH
+#     Update #: 93
+#
+
+"""Command line interface, usable without a display.
+
+    python -m mediocre train --model ann svm
+    python -m mediocre eval --model svm
+    python -m mediocre cv --model ann knn svm --folds 10
+    python -m mediocre tune --model svm --trials 8 --target .95
+    python -m mediocre recognize --model svm images/ glyph.bmp
+    python -m mediocre bench --model ann knn svm
+    python -m mediocre pack --dataset dataset --remove
+"""
+
+import argparse
+import os
+import sys
+import timeit
+from collections import OrderedDict
+
+from mediocre import pack, profiling
+from mediocre.augment import AugmentParam
+from mediocre.cache import FeatureCache
+from mediocre.classes import Classes
+from mediocre.dataset import Dataset
+from mediocre.ocr import ModelException, OCR
+from mediocre.tuning import Search, best, paretoFront
+from mediocre.validation import CrossValidation
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODELS = OrderedDict([('ann', OCR.MODEL_ANN),
+                      ('knn', OCR.MODEL_KNN),
+                      ('svm', OCR.MODEL_SVM)])
+IMAGE_EXT = [".bmp", ".png"]
+
+
+def log(text):
+    sys.stdout.write(text)
+    sys.stdout.flush()
+
+
+def getClasses(args):
+    if args.chars:
+        catalogue = dict((cl.value, cl) for cl in Classes.getClassList())
+        unknown = [c for c in args.chars if c not in catalogue]
+        if unknown:
+            raise SystemExit("Unknown classes: {0}".format(''.join(unknown)))
+        return [catalogue[c] for c in OrderedDict.fromkeys(args.chars)]
+    return Classes.getClassList(args.groups)
+
+
+def getDataset(args):
+    cache = None if args.no_cache else FeatureCache(args.cache)
+    return Dataset(args.dataset, cache, manifest=args.manifest)
+
+
+def findImages(paths):
+    """Expand directories to the images they contain.
+    """
+    images = []
+    for path in paths:
+        if os.path.isdir(path):
+            images.extend(os.path.join(path, file) for file in sorted(os.listdir(path))
+                          if os.path.splitext(file)[1].lower() in IMAGE_EXT)
+        else:
+            images.append(path)
+    return images
+
+
+def loadModel(args, classes, name):
+    ocr = OCR()
+    try:
+        ocr.loadModel(classes, args.models, MODELS[name])
+    except ModelException:
+        raise SystemExit("No {0} model for these classes in {1}, train it first"
+                         .format(name.upper(), args.models))
+    return ocr
+
+
+def train(args):
+    classes = getClasses(args)
+    augmentation = None
+    if args.augment:
+        augmentation = AugmentParam(args.augment)
+    for name in args.model:
+        log("== {0} ==\n".format(name.upper()))
+        memoryBudget = None
+        if args.memory_budget and name == 'ann':
+            memoryBudget = args.memory_budget * 1024 * 1024
+        ocr = OCR()
+        ocr.trainModel(getDataset(args), classes, MODELS[name],
+                       args.train_ratio, args.max_per_class,
+                       args.errors_iteration, log, args.workers, args.seed,
+                       augmentation=augmentation, memoryBudget=memoryBudget)
+        ocr.saveModel(args.models)
+
+
+def evaluate(args):
+    classes = getClasses(args)
+    for name in args.model:
+        log("== {0} ==\n".format(name.upper()))
+        ocr = loadModel(args, classes, name)
+        ocr.evaluateModel(getDataset(args), args.max_per_class, log,
+                          args.workers, args.seed)
+
+
+def crossValidate(args):
+    validation = CrossValidation(getDataset(args), getClasses(args), args.folds,
+                                 not args.no_stratify, args.max_per_class,
+                                 args.workers, args.seed)
+    results = validation.run([MODELS[name] for name in args.model], log)
+    for name in args.model:
+        log("== {0} ==\n{1}".format(name.upper(), results[MODELS[name]]))
+
+
+def tune(args):
+    search = Search(getDataset(args), getClasses(args), args.train_ratio,
+                    args.max_per_class, args.workers, args.seed)
+    types = [MODELS[name] for name in args.model]
+    trials = search.run(types, args.trials, log=log)
+    front = paretoFront(trials)
+    for name in args.model:
+        log("== {0} ==\n".format(name.upper()))
+        log("  {0:>10}{1:>12}{2:>14}  {3}\n".format("Accuracy", "Train (s)",
+                                                    "Predict (ms)", "Parameters"))
+        mine = [trial for trial in trials if trial.type == MODELS[name]]
+        for trial in sorted(mine, key=lambda trial: -trial.accuracy):
+            log("{0} {1:>9.2f}%{2:>12.3f}{3:>14.4f}  {4}\n".format(
+                '*' if trial in front else ' ', trial.accuracy * 100, trial.trainTime,
+                trial.predictTime * 1000, trial.params))
+        chosen = best(mine, args.target)
+        log("Best: {0}\n".format(chosen.params))
+        if not args.no_save:
+            search.save(chosen, mine, args.models, log)
+
+
+def recognize(args):
+    classes = getClasses(args)
+    ocr = loadModel(args, classes, args.model)
+    if args.page:
+        for path in args.paths:
+            log("== {0} ==\n{1}\n".format(path, ocr.recognizePage(path, args.workers).text))
+        return
+    images = findImages(args.paths)
+    chars = ocr.charsFromFiles(images, args.chunk_size, args.workers)
+    for image, cl in zip(images, chars):
+        log("{0}\t{1}\n".format(image, cl.value))
+
+
+def bench(args):
+    classes = getClasses(args)
+    images = findImages([os.path.join(args.dataset, cl.folder) for cl in classes])
+    images = images[:args.samples]
+    log("{0:<6}{1:>16}{2:>18}{3:>14}\n".format("Model", "Train (s)",
+                                               "Recognize (ms)", "Images/s"))
+    for name in args.model:
+        ocr = OCR()
+        start = timeit.default_timer()
+        ocr.trainModel(getDataset(args), classes, MODELS[name],
+                       args.train_ratio, args.max_per_class, 0, None,
+                       args.workers, args.seed)
+        trainTime = timeit.default_timer() - start
+        start = timeit.default_timer()
+        ocr.charsFromFiles(images, args.chunk_size, args.workers)
+        elapsed = timeit.default_timer() - start
+        log("{0:<6}{1:>16.3f}{2:>18.3f}{3:>14.1f}\n".format(
+            name.upper(), trainTime, elapsed * 1000 / max(len(images), 1),
+            len(images) / elapsed if elapsed else 0))
+
+
+def packDataset(args):
+    pack.packFolder(args.dataset, args.remove, log)
+
+
+def unpackDataset(args):
+    pack.unpackFolder(args.dataset, args.format, args.remove, log)
+
+
+def parser():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--groups', nargs='+', default=[Classes.DIGITS],
+                        help="class groups, as in the classes tree (default: Digits)")
+    common.add_argument('--chars', help="classes given as characters, overrides --groups")
+    common.add_argument('--models', default=os.path.join(ROOT, "models"),
+                        help="models folder")
+    common.add_argument('--workers', type=int, default=1)
+    common.add_argument('--profile', action='store_true',
+                        help="time the pre-processing stages")
+
+    data = argparse.ArgumentParser(add_help=False)
+    data.add_argument('--dataset', default=os.path.join(ROOT, "dataset"))
+    data.add_argument('--max-per-class', type=int, default=400)
+    data.add_argument('--seed', type=int)
+    data.add_argument('--cache', default=os.path.join(ROOT, "cache"),
+                      help="pre-processed features cache folder")
+    data.add_argument('--no-cache', action='store_true')
+    data.add_argument('--manifest', action='store_true',
+                      help="keep a manifest of the dataset, for stable splits")
+
+    models = argparse.ArgumentParser(add_help=False)
+    models.add_argument('--model', nargs='+', choices=list(MODELS),
+                        default=list(MODELS))
+
+    parser = argparse.ArgumentParser(prog="mediocre", description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers()
+
+    sub = subparsers.add_parser('train', parents=[common, data, models],
+                                help="train and save models")
+    sub.add_argument('--train-ratio', type=float, default=.5)
+    sub.add_argument('--errors-iteration', type=int, default=0)
+    sub.add_argument('--augment', type=int, default=0, metavar='FACTOR',
+                     help="random variants of every train image, made in memory")
+    sub.add_argument('--memory-budget', type=int, default=0, metavar='MB',
+                     help="train the ANN by minibatches streamed from the dataset")
+    sub.set_defaults(func=train)
+
+    sub = subparsers.add_parser('eval', parents=[common, data, models],
+                                help="evaluate saved models on a dataset")
+    sub.set_defaults(func=evaluate)
+
+    sub = subparsers.add_parser('cv', parents=[common, data, models],
+                                help="cross-validate models on a dataset")
+    sub.add_argument('--folds', type=int, default=CrossValidation.FOLDS)
+    sub.add_argument('--no-stratify', action='store_true',
+                     help="random folds, ignoring class proportions")
+    sub.set_defaults(func=crossValidate)
+
+    sub = subparsers.add_parser('tune', parents=[common, data, models],
+                                help="search hyperparameters, save the best models")
+    sub.add_argument('--train-ratio', type=float, default=.5)
+    sub.add_argument('--trials', type=int,
+                     help="random configurations per model (default: whole grid)")
+    sub.add_argument('--target', type=float,
+                     help="accuracy to reach, between 0 and 1: the fastest "
+                     "configuration reaching it is saved")
+    sub.add_argument('--no-save', action='store_true')
+    sub.set_defaults(func=tune)
+
+    sub = subparsers.add_parser('recognize', parents=[common],
+                                help="recognize image files or folders")
+    sub.add_argument('paths', nargs='+')
+    sub.add_argument('--model', choices=list(MODELS), default='svm')
+    sub.add_argument('--chunk-size', type=int, default=OCR.CHUNK_SIZE)
+    sub.add_argument('--page', action='store_true',
+                     help="images are pages or lines of text")
+    sub.set_defaults(func=recognize)
+
+    sub = subparsers.add_parser('bench', parents=[common, data, models],
+                                help="time training and recognition")
+    sub.add_argument('--train-ratio', type=float, default=.5)
+    sub.add_argument('--samples', type=int, default=1000,
+                     help="images to recognize")
+    sub.add_argument('--chunk-size', type=int, default=OCR.CHUNK_SIZE)
+    sub.set_defaults(func=bench)
+
+    sub = subparsers.add_parser('pack', parents=[common],
+                                help="pack every class folder of a dataset")
+    sub.add_argument('--dataset', default=os.path.join(ROOT, "dataset"))
+    sub.add_argument('--remove', action='store_true', help="remove the packed images")
+    sub.set_defaults(func=packDataset)
+
+    sub = subparsers.add_parser('unpack', parents=[common],
+                                help="write the packs of a dataset back to folders")
+    sub.add_argument('--dataset', default=os.path.join(ROOT, "dataset"))
+    sub.add_argument('--format', default="bmp", choices=["bmp", "png"])
+    sub.add_argument('--remove', action='store_true', help="remove the packs")
+    sub.set_defaults(func=unpackDataset)
+    return parser
+
+
+def main(argv=None):
+    args = parser().parse_args(argv)
+    if args.profile:
+        profiling.enable()
+    result = args.func(args)
+    # Training and evaluation reports already include the stages.
+    if profiling.enabled() and args.func not in (train, evaluate):
+        log(profiling.report())
+    return result
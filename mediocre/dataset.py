@@ -9,14 +9,17 @@
 #     Update #: 326
 #
 
+import errno
 import os
 import random
+import tempfile
 
+import cv2
 import numpy as np
-from PyQt5.QtCore import Qt
-from PyQt5.QtGui import QPainter, QPixmap, QVector3D
-from PyQt5.QtWidgets import (QGraphicsLineItem, QGraphicsRotation,
-                             QGraphicsScene)
+
+from mediocre import augment, pack
+from mediocre.manifest import Manifest, currentHash
+from mediocre.parallel import parallelMap
 
 
 class RandomParam():
@@ -30,62 +33,160 @@ class RandomParam():
 
 
 class Dataset(object):
+    CHUNK_SIZE = 4096
 
-    def __init__(self, folder):
+    def __init__(self, folder, cache=None, packed=False, manifest=False):
         self._folder = folder
+        self._cache = cache
+        self._packed = packed
+        self._manifest = manifest
         self._classes = None
         self._last = []
+        self._sequences = {}
+        self._entries = {}
+        self._trainJobs = None
+        self._testJobs = None
+        self.streamed = False
 
     @property
     def trainSampleCount(self):
-        if self.trainSamples.size == 0:
-            return 0
-        trainSampleCount, size = self.trainSamples.shape
-        return trainSampleCount
+        return len(self.trainResponses)
 
     @property
     def testSampleCount(self):
-        if self.testSamples.size == 0:
-            return 0
-        testSampleCount, size = self.testSamples.shape
-        return testSampleCount
+        return len(self.testResponses)
 
     def getResponse(self, index):
         return self.classes[int(index)]
 
     def addDatum(self, prefix, cl, pixmap, format):
+        """Save an image, a QPixmap or an array, in the folder of cl,
+        or append it to the pack of cl if there is one or if the
+        dataset is packed.
+        """
+        path = pack.packPath(self._folder, cl.folder)
+        if self._packed or os.path.isfile(path):
+            self.__appendToPack(path, pixmap)
+            return
         folder = cl.folder
         dirs = os.path.join(self._folder, folder)
         if not os.path.exists(dirs):
             os.makedirs(dirs)
-        path = self.generateFilename(dirs, prefix, format)
-        if pixmap.save(path, format):
-            self._last.append(path)
-            print "Write", path
+        data = self.__encode(pixmap, format)
+        if data is None:
+            return
+        path = self.generateFilename(dirs, prefix, format, data)
+        self._last.append(path)
+        print "Write", path
+
+    def __encode(self, pixmap, format):
+        """Returns the bytes of an image file of an array or a QPixmap,
+        None if it cannot be encoded.
+        """
+        if isinstance(pixmap, np.ndarray):
+            encoded, data = cv2.imencode('.' + format, pixmap)
+            return data.tostring() if encoded else None
+        from PyQt5.QtCore import QBuffer, QByteArray, QIODevice
+        array = QByteArray()
+        buffer = QBuffer(array)
+        buffer.open(QIODevice.WriteOnly)
+        if not pixmap.save(buffer, format):
+            return None
+        return bytes(array)
+
+    def __appendToPack(self, path, pixmap):
+        if isinstance(pixmap, np.ndarray):
+            image = pixmap
+        else:
+            from mediocre.qimage import imageToArray
+            image = imageToArray(pixmap)
+        if image.ndim == 3:
+            code = cv2.COLOR_BGRA2GRAY if image.shape[2] == 4 else cv2.COLOR_BGR2GRAY
+            image = cv2.cvtColor(image, code)
+        if not os.path.isfile(path):
+            if not os.path.isdir(self._folder):
+                os.makedirs(self._folder)
+            try:
+                pack.ClassPack.create(path, *image.shape)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+        entry = pack.PackEntry(path, pack.openPack(path).append(image))
+        self._last.append(entry)
+        print "Write", entry
 
     def removeLast(self):
         if self._last:
             path = self._last[-1]
-            os.remove(path)
+            if isinstance(path, pack.PackEntry):
+                pack.openPack(path.path).delete(path.index)
+            else:
+                self.__release(path)
             print "Remove", path
             self._last.pop(-1)
             return True
         return False
 
-    def generateFilename(self, folder, prefix, ext):
-        """Generate a filename in folder.
+    def __release(self, path):
+        """Remove a file, and give its number back if it was the last one.
+        """
+        os.remove(path)
+        filename, i, ext = path.rsplit('.', 2)
+        key = (filename, ext)
+        if self._sequences.get(key) == int(i) + 1:
+            self._sequences[key] = int(i)
+
+    def generateFilename(self, folder, prefix, ext, data):
+        """Write data to a generated filename in folder.
         folder/prefix-folder.0.ext
         """
         filename = os.path.basename(os.path.normpath(folder))
         filename = "{0}{1}".format(prefix, filename)
-        path = self.getIncrementedFilename(os.path.join(folder, filename), ext)
+        path = self.getIncrementedFilename(os.path.join(folder, filename), ext, data)
         return path
 
-    def getIncrementedFilename(self, filename, ext):
-        i = 0
-        while os.path.isfile("{0}.{1}.{2}".format(filename, i, ext)):
-            i += 1
-        return "{0}.{1}.{2}".format(filename, i, ext)
+    def getIncrementedFilename(self, filename, ext, data):
+        """Write data to the next free filename.i.ext, returns its path.
+        The next number of each sequence is found by scanning its folder
+        once. data is written to a .tmp file first, then hard linked to
+        its name: a link fails if the name is taken, so concurrent
+        writers skip the numbers others took instead of sharing them,
+        and a scan never sees an empty or partial image.
+        """
+        key = (filename, ext)
+        if key not in self._sequences:
+            self._sequences[key] = self.__nextNumber(filename, ext)
+        i = self._sequences[key]
+        fd, tmp = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(filename) or '.')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                file.write(data)
+            while True:
+                path = "{0}.{1}.{2}".format(filename, i, ext)
+                try:
+                    os.link(tmp, path)
+                except OSError as e:
+                    if e.errno != errno.EEXIST:
+                        raise
+                    i += 1
+                    continue
+                self._sequences[key] = i + 1
+                return path
+        finally:
+            os.remove(tmp)
+
+    def __nextNumber(self, filename, ext):
+        """Number following the highest of folder/name.i.ext files.
+        """
+        folder, name = os.path.split(filename)
+        head, tail = name + '.', '.' + ext
+        last = -1
+        for file in os.listdir(folder or '.'):
+            if file.startswith(head) and file.endswith(tail):
+                number = file[len(head):len(file) - len(tail)]
+                if number.isdigit():
+                    last = max(last, int(number))
+        return last + 1
 
     def folder(self):
         return self._folder
@@ -93,79 +194,152 @@ class Dataset(object):
     def setFolder(self, folder):
         self._folder = folder
 
-    def randomRotate(self, item, maxAngle, axis):
-        transform = QGraphicsRotation()
-        transform.setOrigin(QVector3D(item.boundingRect().center()))
-        transform.setAngle(random.uniform(-maxAngle, maxAngle))
-        transform.setAxis(axis)
-        transformations = item.transformations()
-        transformations.append(transform)
-        item.setTransformations(transformations)
-
-    def generateRandom(self, scene, group, canvas, params):
-        penWidth = random.randint(params.minThick, params.maxThick)
-        for item in scene.items():
-            if item.group() == group:
-                pen = item.pen()
-                pen.setWidth(penWidth)
-                item.setPen(pen)
-        self.randomRotate(group, params.xAngle, Qt.XAxis)
-        self.randomRotate(group, params.yAngle, Qt.YAxis)
-        self.randomRotate(group, params.zAngle, Qt.ZAxis)
-        pixmap = QPixmap(params.width, params.height)
-        pixmap.fill(Qt.white)
-        painter = QPainter(pixmap)
-        painter.setRenderHint(QPainter.Antialiasing)
-        scene.render(painter, source=canvas)
-        painter.end()
-        group.setTransformations([])
-        return pixmap
-
-    def generateData(self, canvas, lines, params):
-        scene = QGraphicsScene()
-        scene.setSceneRect(canvas)
-        group = scene.createItemGroup([])
-        for line in lines:
-            clone = QGraphicsLineItem(line)
-            clone.setLine(line.line())
-            clone.setPen(line.pen())
-            scene.addItem(clone)
-            group.addToGroup(clone)
-        pixmaps = []
-        for i in xrange(params.count):
-            pixmaps.append(self.generateRandom(scene, group, canvas, params))
-        return pixmaps
-
-    def preprocess(self, classes, maxPerClass, trainRatio, preprocess):
+    def cache(self):
+        return self._cache
+
+    def setCache(self, cache):
+        self._cache = cache
+
+    def generateData(self, canvas, lines, params, seed=None, workers=1):
+        """Render params.count random variants of the lines
+        ((x1, y1), (x2, y2)) drawn on canvas (x, y, w, h).
+        Returns a (count, height, width) uint8 array.
+        """
+        return augment.generate(canvas, lines, params, seed, workers)
+
+    def preprocess(self, classes, maxPerClass, trainRatio, model,
+                   workers=1, seed=None, progress=None, stream=False):
+        """Load and pre-process the images of classes.
+        progress(done, total) is called after each chunk of images.
+        With stream, images are only selected: trainBatches and
+        testBatches load them batch by batch.
+        """
         self.maxPerClass = maxPerClass
         self.trainRatio = trainRatio
         self.classes = classes
-        self.__stackArrays(self.__getItems(self.trainRatio, preprocess))
+        trainJobs, testJobs = self.__select(trainRatio, seed)
+        self.streamed = stream
+        if stream:
+            self._trainJobs, self._testJobs = trainJobs, testJobs
+            self.trainFiles = [image for cl, image in trainJobs]
+            self.trainSamples = np.array([])
+            self.trainResponses = np.array([self.classes.index(cl)
+                                            for cl, image in trainJobs])
+            self.testSamples = np.array([])
+            self.testResponses = np.array([self.classes.index(cl)
+                                           for cl, image in testJobs])
+        else:
+            self._trainJobs = self._testJobs = None
+            items = self.__loadItems(trainJobs + testJobs, model, workers, progress)
+            self.__stackArrays((items[:len(trainJobs)], items[len(trainJobs):]), model)
+        if self._cache:
+            self._cache.prune()
+
+    def trainBatches(self, model, batchSize, workers=1, seed=None, progress=None):
+        """Yield the (samples, responses) of the train images of a
+        streamed preprocess, in random batches of batchSize images.
+        progress(done, total) is called after each chunk of images.
+        """
+        order = np.random.RandomState(seed).permutation(len(self._trainJobs))
+        return self.__batches([self._trainJobs[i] for i in order], model,
+                              batchSize, workers, progress)
+
+    def testBatches(self, model, batchSize, workers=1, progress=None):
+        """Yield the (samples, responses) of the test images of a
+        streamed preprocess, in batches of batchSize images.
+        """
+        return self.__batches(self._testJobs, model, batchSize, workers, progress)
+
+    def __batches(self, jobs, model, batchSize, workers=1, progress=None):
+        for start in xrange(0, len(jobs), batchSize):
+            report = None
+            if progress:
+                report = lambda done, total: progress(start + done, len(jobs))
+            items = self.__loadItems(jobs[start:start + batchSize], model, workers,
+                                     report)
+            yield self.__stackArraysAux(items, model)
 
-    def __getItems(self, trainRatio, preprocess):
-        """Create dataset items.
+    def __select(self, trainRatio, seed=None):
+        """Select the (class, image) of the train and test sets.
+        Images are selected and split sequentially, so the result only
+        depends on the seed. With a manifest, an image is a train image
+        when its split key is below trainRatio, so the split stays the
+        same across runs.
         """
-        trainItems = []
-        testItems = []
+        rand = random.Random(seed)
+        manifest = self.__updateManifest()
+        self._entries = {}
+        trainJobs = []
+        testJobs = []
         for cl in self.classes:
             folder = os.path.join(self._folder, cl.folder)
-            images = self.__getImages(folder)
-            random.shuffle(images)
-            currentClassItems = []
-            for i, image in enumerate(images):
-                if i >= self.maxPerClass:
-                    break
-                item = DatasetItem(preprocess, cl)
-                item.loadFromFile(image)
-                currentClassItems.append(item)
-            trainCount = int(np.ceil(min(len(images), self.maxPerClass) * trainRatio))
-            trainItems.extend(currentClassItems[:trainCount])
-            testItems.extend(currentClassItems[trainCount:])
-        return (trainItems, testItems)
+            if manifest and not os.path.isfile(folder + pack.EXT):
+                listed = manifest.images(cl.folder)
+                self._entries.update(listed)
+                train, test = self.__splitByKey(listed, trainRatio)
+            else:
+                images = sorted(self.__getImages(folder))
+                rand.shuffle(images)
+                images = images[:self.maxPerClass]
+                trainCount = int(np.ceil(len(images) * trainRatio))
+                train, test = images[:trainCount], images[trainCount:]
+            trainJobs.extend((cl, image) for image in train)
+            testJobs.extend((cl, image) for image in test)
+        return (trainJobs, testJobs)
+
+    def __splitByKey(self, listed, trainRatio):
+        """Split the (path, entry) of a manifest: images whose split key
+        is below trainRatio are train images, whatever the others are.
+        maxPerClass is shared between the two sets as trainRatio says.
+        """
+        trainCount = int(np.ceil(self.maxPerClass * trainRatio))
+        train = [image for image, entry in listed if entry['split'] < trainRatio]
+        test = [image for image, entry in listed if entry['split'] >= trainRatio]
+        return train[:trainCount], test[:self.maxPerClass - trainCount]
+
+    def __loadItems(self, jobs, model, workers=1, progress=None):
+        """Pre-process the (class, image) jobs by chunks, with a pool of workers.
+        """
+        fingerprint = model.fingerprint()
+
+        def loadItem(job):
+            cl, image = job
+            item = DatasetItem(model, cl)
+            if isinstance(image, pack.PackEntry):
+                item.loadFromPack(image, self._cache, fingerprint)
+            else:
+                entry = self._entries.get(image)
+                digest = currentHash(image, entry) if entry else None
+                item.loadFromFile(image, self._cache, fingerprint, digest)
+            return item
+
+        items = []
+        if progress:
+            progress(0, len(jobs))
+        for start in xrange(0, len(jobs), self.CHUNK_SIZE):
+            items.extend(parallelMap(loadItem, jobs[start:start + self.CHUNK_SIZE],
+                                     workers))
+            if progress:
+                progress(len(items), len(jobs))
+        return items
+
+    def __updateManifest(self):
+        """Returns the up to date manifest of the classes, None if the
+        dataset has none and is not asked to keep one.
+        """
+        manifest = Manifest(self._folder)
+        if not self._manifest and not os.path.isfile(manifest.path()):
+            return None
+        manifest.update([cl.folder for cl in self.classes])
+        return manifest
 
     def __getImages(self, folder):
-        """Returns a list of all images in folder.
+        """Returns a list of all images in folder, or the entries
+        of the pack of folder if there is one.
         """
+        path = folder + pack.EXT
+        if os.path.isfile(path):
+            return pack.entries(path)
         imgExt = [".bmp", ".png"]
         images = []
         if os.path.isdir(folder):
@@ -175,47 +349,75 @@ class Dataset(object):
                     images.append(os.path.join(folder, file))
         return images
 
-    def __stackArraysAux(self, items):
+    def __stackArraysAux(self, items, model):
         """Create samples and responses arrays.
+        Features are extracted from the stacked glyphs by chunks, and
+        keep their type: uint8 pixels, unless the model computes others.
         """
         if not items:
             return (np.array([]), np.array([]))
+        responses = [self.classes.index(item.cl) for item in items]
         samples = []
-        responses = []
-        for item in items:
-            responses.append(self.classes.index(item.cl))
-            samples.append(item.sample)
+        for start in xrange(0, len(items), self.CHUNK_SIZE):
+            chunk = items[start:start + self.CHUNK_SIZE]
+            glyphs = np.array([item.preprocessed for item in chunk])
+            samples.append(model.features(glyphs))
         return (np.vstack(samples), np.array(responses))
 
-    def __stackArrays(self, items):
+    def __stackArrays(self, items, model):
         trainItems, testItems = items
-        self.trainSamples, self.trainResponses = self.__stackArraysAux(trainItems)
-        self.testSamples, self.testResponses = self.__stackArraysAux(testItems)
+        self.trainFiles = [item.input for item in trainItems]
+        self.trainSamples, self.trainResponses = self.__stackArraysAux(trainItems, model)
+        self.testSamples, self.testResponses = self.__stackArraysAux(testItems, model)
 
 
 class DatasetItem(object):
     """An item in the data set.
-    Handle pre-processing of that item.
+    Handle pre-processing of that item, the normalized glyph is kept
+    in preprocessed and converted to a sample by the model.
     """
     RESIZE = 16
 
-    def __init__(self, preprocess=None, cl=None):
+    def __init__(self, model=None, cl=None):
         self.input = None
         self.preprocessed = None
-        self.preprocess = preprocess
+        self.model = model
         self.cl = cl
 
-    def loadFromFile(self, filename):
+    def loadFromFile(self, filename, cache=None, fingerprint=None, digest=None):
         if not os.path.isfile(filename):
             raise OSError(2, 'File not found', filename)
-        self.preprocessed = self.preprocess(filename)
+        self.input = filename
+        if cache:
+            self.preprocessed = cache.get(filename, fingerprint, digest)
+            if self.preprocessed is not None:
+                return
+        self.preprocessed = self.model.glyph(filename)
+        if cache:
+            cache.put(filename, fingerprint, self.preprocessed, digest)
+
+    def loadFromPack(self, entry, cache=None, fingerprint=None):
+        """Load an image of a pack, cached by the hash of its record.
+        """
+        self.input = entry
+        digest = entry.digest() if cache else None
+        if cache:
+            self.preprocessed = cache.get(entry.path, fingerprint, digest)
+            if self.preprocessed is not None:
+                return
+        self.preprocessed = self.model.glyph(entry.read())
+        if cache:
+            cache.put(entry.path, fingerprint, self.preprocessed, digest)
 
     def loadFromImage(self, img):
-        img.save("/tmp/buffer.bmp", "BMP")
-        self.loadFromFile("/tmp/buffer.bmp")
-        os.remove("/tmp/buffer.bmp")
+        """Load a QImage or QPixmap without copying its pixels.
+        """
+        from mediocre.qimage import imageToArray
+        self.loadFromArray(imageToArray(img))
+
+    def loadFromArray(self, image):
+        self.preprocessed = self.model.glyph(image)
 
     @property
     def sample(self):
-        sample = np.array(self.preprocessed)
-        return sample.ravel().astype(np.float32)
+        return self.model.features(self.preprocessed[np.newaxis]).ravel()
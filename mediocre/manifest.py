@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# manifest.py
+#
+# Author: Yann KOETH
+# Created: Tue Dec  9 09:52:14 2014 (+0100)
+# Last-Updated: Tue Dec  9 13:26:40 2014 (+0100)
+#           By: Yann KOETH
+#     Update #: 58
+#
+
+"""Manifest of the images of a dataset, stored in root/manifest.json.
+
+For every class folder it records the folder modification time and,
+for every image, its size, modification time, content hash and split
+key. A folder whose modification time did not change is not rescanned,
+and only new or modified images are hashed: an image rewritten in
+place, which leaves the folder time unchanged, is noticed at the next
+change of its folder. Until then currentHash tells that its hash is
+stale, and its features are not cached under it.
+
+The split key, in [0, 1), is derived from the content hash: an image
+is a train image when its key is below the train ratio, so it keeps
+its side of the split across runs, whatever files are added or removed.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+IMAGE_EXT = [".bmp", ".png"]
+
+
+def _scan(folder):
+    """Yield (name, size, mtime) of the images of folder.
+    """
+    if scandir is not None:
+        for entry in scandir(folder):
+            if os.path.splitext(entry.name)[1].lower() in IMAGE_EXT and entry.is_file():
+                stat = entry.stat()
+                yield entry.name, stat.st_size, stat.st_mtime
+        return
+    for name in os.listdir(folder):
+        if os.path.splitext(name)[1].lower() in IMAGE_EXT:
+            stat = os.stat(os.path.join(folder, name))
+            yield name, stat.st_size, stat.st_mtime
+
+
+def fileHash(path):
+    md5 = hashlib.md5()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 16), b''):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+def currentHash(path, entry):
+    """The hash of a manifest entry if path still has its size and
+    modification time, None if the file changed since it was hashed.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    if stat.st_size != entry['size'] or stat.st_mtime != entry['mtime']:
+        return None
+    return entry['hash']
+
+
+def splitKey(digest):
+    """Stable key in [0, 1) ordering the images of a class.
+    """
+    return int(digest[:8], 16) / float(1 << 32)
+
+
+class Manifest(object):
+    FILENAME = "manifest.json"
+    VERSION = 1
+
+    def __init__(self, root):
+        self._root = root
+        self._path = os.path.join(root, self.FILENAME)
+        self._folders = {}
+        self._changed = False
+        try:
+            with open(self._path) as file:
+                data = json.load(file)
+        except (IOError, ValueError):
+            return
+        if data.get('version') == self.VERSION:
+            self._folders = data['folders']
+
+    def path(self):
+        return self._path
+
+    def update(self, folders):
+        """Rescan the class folders that changed since the last update,
+        then save the manifest if anything changed.
+        """
+        for folder in folders:
+            self.__updateFolder(folder)
+        if self._changed:
+            self.save()
+
+    def __updateFolder(self, name):
+        folder = os.path.join(self._root, name)
+        if not os.path.isdir(folder):
+            if self._folders.pop(name, None) is not None:
+                self._changed = True
+            return
+        mtime = os.stat(folder).st_mtime
+        known = self._folders.get(name)
+        if known is not None and known['mtime'] == mtime:
+            return
+        old = known['files'] if known else {}
+        files = {}
+        for file, size, fileMtime in _scan(folder):
+            entry = old.get(file)
+            if entry is None or entry['size'] != size or entry['mtime'] != fileMtime:
+                digest = fileHash(os.path.join(folder, file))
+                entry = {'size': size, 'mtime': fileMtime, 'hash': digest,
+                         'class': name, 'split': splitKey(digest)}
+            files[file] = entry
+        self._folders[name] = {'mtime': mtime, 'files': files}
+        self._changed = True
+
+    def images(self, name):
+        """Returns the (path, entry) of the images of a class folder,
+        ordered by split key. Entries are dicts of size, mtime, hash,
+        class and split.
+        """
+        known = self._folders.get(name)
+        if known is None:
+            return []
+        folder = os.path.join(self._root, name)
+        files = sorted(known['files'].items(),
+                       key=lambda item: (item[1]['split'], item[0]))
+        return [(os.path.join(folder, file), entry) for file, entry in files]
+
+    def save(self):
+        if not os.path.isdir(self._root):
+            return
+        fd, tmp = tempfile.mkstemp(suffix=".tmp", dir=self._root)
+        with os.fdopen(fd, 'w') as file:
+            json.dump({'version': self.VERSION, 'folders': self._folders}, file)
+        os.rename(tmp, self._path)
+        self._changed = False
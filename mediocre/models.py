@@ -9,15 +9,29 @@
 #     Update #: 306
 #
 
+import hashlib
 import os
+import pickle
+import struct
+import tempfile
+from contextlib import closing
 
 import cv2
 import numpy as np
 from numpy.linalg import norm
 
+from mediocre import neighbors
+from mediocre.buffer import SampleBuffer
+
 
 class StatModel(object):
     RESIZE = 16
+    BINS_NB = 16
+    BLUR_SIZE = 5
+    THRESH_BLOCK_SIZE = 31
+    THRESH_C = 2
+    CHUNK_SIZE = 4096
+    WARM_START = True
 
     def __init__(self, nClass):
         self.classificationCount = nClass
@@ -69,42 +83,113 @@ class StatModel(object):
         return img
 
     def _hog(self, img):
-        gx = cv2.Sobel(img, cv2.CV_32F, 1, 0)
-        gy = cv2.Sobel(img, cv2.CV_32F, 0, 1)
+        return self._hogBatch(img[np.newaxis])[0]
+
+    def _hogBatch(self, imgs):
+        """Compute the HOG descriptors of a (N, H, W) stack of images.
+        Each image is split in 4 cells of BINS_NB orientation bins.
+        """
+        count, h, w = imgs.shape
+        # Pad every image like cv2.Sobel does (BORDER_REFLECT_101) so the
+        # whole stack can be filtered in a single call.
+        padded = np.pad(imgs, ((0, 0), (1, 1), (1, 1)), mode='reflect')
+        stacked = padded.reshape(count * (h + 2), w + 2)
+        gx = cv2.Sobel(stacked, cv2.CV_32F, 1, 0).reshape(padded.shape)
+        gy = cv2.Sobel(stacked, cv2.CV_32F, 0, 1).reshape(padded.shape)
+        gx = np.ascontiguousarray(gx[:, 1:-1, 1:-1]).reshape(count * h, w)
+        gy = np.ascontiguousarray(gy[:, 1:-1, 1:-1]).reshape(count * h, w)
         mag, ang = cv2.cartToPolar(gx, gy)
-        bin_n = 16
-        bin = np.int32(bin_n * ang / (2 * np.pi))
-        bin_cells = bin[:10, :10], bin[10:, :10], bin[:10, 10:], bin[10:, 10:]
-        mag_cells = mag[:10, :10], mag[10:, :10], mag[:10, 10:], mag[10:, 10:]
-        hists = [np.bincount(b.ravel(), m.ravel(), bin_n)
-                 for b, m in zip(bin_cells, mag_cells)]
-        hist = np.hstack(hists)
+        bin_n = self.BINS_NB
+        # cartToPolar may return exactly 2 pi, which is the angle 0.
+        bin = np.int32(bin_n * ang / (2 * np.pi)) % bin_n
+        bin = bin.reshape(count, h, w)
+        # Cells are ordered top-left, bottom-left, top-right, bottom-right.
+        cells = ((np.arange(h) >= h // 2)[:, np.newaxis] +
+                 2 * (np.arange(w) >= w // 2)[np.newaxis, :])
+        index = (np.arange(count)[:, np.newaxis, np.newaxis] * 4 + cells) * bin_n + bin
+        hist = np.bincount(index.ravel(), mag.ravel(), count * 4 * bin_n)
+        hist = hist.reshape(count, 4 * bin_n)
 
         eps = 1e-7
-        hist /= hist.sum() + eps
+        hist /= hist.sum(axis=1)[:, np.newaxis] + eps
         hist = np.sqrt(hist)
-        hist /= norm(hist) + eps
+        hist /= norm(hist, axis=1)[:, np.newaxis] + eps
         return hist
 
-    def preprocess(self, filename):
-        """Pre-process image :
+    def grayscale(self, image):
+        """Convert a BGR or BGRA image to grayscale.
+        """
+        if image.ndim == 2:
+            return image
+        if image.shape[2] == 4:
+            return cv2.cvtColor(image, cv2.COLOR_BGRA2GRAY)
+        return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+    def read(self, filename):
+        if not os.path.isfile(filename):
+            raise OSError(2, 'File not found', filename)
+        return cv2.imread(filename, cv2.CV_LOAD_IMAGE_COLOR)
+
+    def threshold(self, gray):
+        """Gaussian Blur (remove noise) then Threshold (black and white image).
+        """
+        blur = cv2.GaussianBlur(src=gray, ksize=(self.BLUR_SIZE, self.BLUR_SIZE),
+                                sigmaX=0)
+        return cv2.adaptiveThreshold(src=blur, maxValue=255,
+                                     adaptiveMethod=cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                                     thresholdType=cv2.THRESH_BINARY_INV,
+                                     blockSize=self.THRESH_BLOCK_SIZE,
+                                     C=self.THRESH_C)
+
+    def normalize(self, binary):
+        """Crop a black and white image to fit its bounding box and resize it.
+        """
+        cropped = self._cropToFit(binary)
+        squared = self._ratioResize(cropped)
+        return cv2.resize(squared, (self.RESIZE, self.RESIZE))
+
+    def glyph(self, image):
+        """Pre-process image (filename or array) up to a normalized glyph :
         - Convert To Grayscale
         - Gaussian Blur (remove noise)
         - Threshold (black and white image)
         - Crop to fit bounding box
         - Resize
         """
-        self.input = cv2.imread(filename, cv2.CV_LOAD_IMAGE_COLOR)
-        gray = cv2.cvtColor(self.input, cv2.COLOR_BGR2GRAY)
-        blur = cv2.GaussianBlur(src=gray, ksize=(5, 5), sigmaX=0)
-        thresh = cv2.adaptiveThreshold(src=blur, maxValue=255,
-                                       adaptiveMethod=cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-                                       thresholdType=cv2.THRESH_BINARY_INV,
-                                       blockSize=31, C=2)
-        cropped = self._cropToFit(thresh)
-        squared = self._ratioResize(cropped)
-        resized = cv2.resize(squared, (self.RESIZE, self.RESIZE))
-        return resized
+        if isinstance(image, basestring):
+            image = self.read(image)
+        return self.normalize(self.threshold(self.grayscale(image)))
+
+    def features(self, glyphs):
+        """Convert a (N, RESIZE, RESIZE) stack of glyphs to samples.
+        Samples are the glyph pixels, kept as uint8: the models convert
+        them to float32 by chunks, when they need to.
+        """
+        return np.ascontiguousarray(glyphs, np.uint8).reshape(len(glyphs), -1)
+
+    def _predictChunks(self, predict, samples):
+        """Apply predict to CHUNK_SIZE samples at a time, converted to
+        float32, so uint8 samples are never converted as a whole.
+        """
+        chunks = [predict(np.asarray(samples[start:start + self.CHUNK_SIZE], np.float32))
+                  for start in xrange(0, len(samples), self.CHUNK_SIZE)]
+        if not chunks:
+            return np.array([], np.int64)
+        return np.concatenate(chunks)
+
+    def preprocess(self, image):
+        return self.features(self.glyph(image)[np.newaxis])[0]
+
+    def fingerprint(self):
+        """Identify the glyph pre-processing pipeline.
+        Models sharing the same pipeline share the same fingerprint.
+        """
+        stages = ('read', 'grayscale', 'threshold', 'normalize')
+        pipeline = [[c for c in type(self).__mro__ if stage in vars(c)][0].__name__
+                    for stage in stages]
+        params = (pipeline, self.RESIZE, self.BLUR_SIZE,
+                  self.THRESH_BLOCK_SIZE, self.THRESH_C)
+        return hashlib.md5(repr(params)).hexdigest()
 
     def load(self, filename):
         if not os.path.isfile(filename):
@@ -126,96 +211,285 @@ class StatModel(object):
 
 
 class ANN(StatModel):
-
-    def __init__(self, nClass):
+    """Multi-layer perceptron.
+    Updates warm-start from the current weights, on the new samples and
+    as many samples replayed from the training set, so their cost is in
+    proportion to the number of new samples.
+    trainStream learns by minibatches instead, from a source too large
+    to be held in memory.
+    """
+    HIDDEN = 16
+    MAX_ITER = 2000
+    EPSILON = 0.002
+    REPLAY = 1
+    EPOCHS = 10
+    BATCH_ITER = 50
+    MEMORY_BUDGET = 256 * 1024 * 1024
+
+    def __init__(self, nClass, hidden=HIDDEN, maxIter=MAX_ITER, epsilon=EPSILON):
         super(ANN, self).__init__(nClass)
+        self.hidden = hidden
+        self.maxIter = maxIter
+        self.epsilon = epsilon
         self._model = cv2.ANN_MLP()
-        self._samples = np.array([])
-        self._responses = np.array([])
-
-    def train(self, samples, responses, updateBase=False):
-        if updateBase:
-            if self._samples.any():
-                samples = np.vstack([samples, self._samples])
-                responses = self.unrollResponses(responses).reshape(-1, self.classificationCount)
-                responses = np.vstack([responses, self._responses])
-            else:
-                return self._model
-        else:
-            responses = self.unrollResponses(responses).reshape(-1, self.classificationCount)
-
-        sampleCount, sampleSize = samples.shape
-        layers = np.int32([sampleSize, 16, self.classificationCount])
-        self._model.create(layers, cv2.ANN_MLP_SIGMOID_SYM, 1, 1)
+        self._samples = None
+        self._responses = None
+        self._buffer = None
 
-        maxIter = 2000
-        epsilon = 0.002
+    def __params(self, maxIter=None):
         condition = cv2.TERM_CRITERIA_COUNT | cv2.TERM_CRITERIA_EPS
-        criteria = (condition, maxIter, epsilon)
-
-        params = {
+        if maxIter is None:
+            maxIter = self.maxIter
+        criteria = (condition, maxIter, self.epsilon)
+        return {
             'term_crit': criteria,
             'train_method': cv2.ANN_MLP_TRAIN_PARAMS_BACKPROP,
             'bp_dw_scale': 0.1,
             'bp_moment_scale': 0.1
         }
-        self._samples = samples
-        self._responses = np.float32(responses)
-        self._model.train(inputs=samples, outputs=self._responses,
-                          sampleWeights=None, params=params)
+
+    def train(self, samples, responses, updateBase=False):
+        """The training set is kept by reference, the first update copies
+        it in a buffer to append the new samples to.
+        """
+        if updateBase:
+            if self._samples is None:
+                return self._model
+            if self._buffer is None:
+                self._buffer = SampleBuffer(self._samples, self._responses)
+            rand = np.random.RandomState(len(self._buffer))
+            replay = rand.randint(0, len(self._buffer), self.REPLAY * len(samples))
+            inputs = np.float32(np.vstack([samples, self._buffer.samples[replay]]))
+            targets = self.__outputs(np.append(responses, self._buffer.responses[replay]))
+            self._buffer.append(samples, responses)
+            self._samples, self._responses = self._buffer.samples, self._buffer.responses
+            self._model.train(inputs=inputs, outputs=targets,
+                              sampleWeights=None, params=self.__params(),
+                              flags=cv2.ANN_MLP_UPDATE_WEIGHTS)
+            return self._model
+
+        self.__create(samples.shape[1])
+        self._samples, self._responses, self._buffer = samples, responses, None
+        # OpenCV needs the whole set as float32, the samples stay uint8.
+        self._model.train(inputs=np.float32(samples), outputs=self.__outputs(responses),
+                          sampleWeights=None, params=self.__params())
+
+    def __outputs(self, responses):
+        outputs = self.unrollResponses(responses).reshape(-1, self.classificationCount)
+        return np.float32(outputs)
+
+    def __create(self, sampleSize):
+        layers = np.int32([sampleSize] + list(np.atleast_1d(self.hidden)) +
+                          [self.classificationCount])
+        self._model.create(layers, cv2.ANN_MLP_SIGMOID_SYM, 1, 1)
+
+    def batchSize(self, budget=MEMORY_BUDGET):
+        """Samples per minibatch fitting in budget bytes: their float32
+        features and outputs, and as much for the copies of OpenCV.
+        """
+        glyph = np.zeros((1, self.RESIZE, self.RESIZE), np.uint8)
+        sampleSize = self.features(glyph).shape[1]
+        return max(1, budget // (2 * 4 * (sampleSize + self.classificationCount)))
+
+    def trainStream(self, batches, epochs=EPOCHS, progress=None):
+        """Train by minibatches: batches(epoch) returns a generator of
+        the (samples, responses) of an epoch, closed if the epoch stops
+        early. The first batch initializes the weights, every batch then
+        updates them for up to BATCH_ITER iterations, and progress(epoch)
+        is called at the end of each epoch.
+        The samples are not kept, updateBase has nothing to replay.
+        """
+        self._samples = self._responses = self._buffer = None
+        created = False
+        for epoch in xrange(epochs):
+            with closing(batches(epoch)) as source:
+                for samples, responses in source:
+                    if not len(samples):
+                        continue
+                    outputs = self.__outputs(responses)
+                    flags = cv2.ANN_MLP_UPDATE_WEIGHTS
+                    if not created:
+                        self.__create(samples.shape[1])
+                        flags, created = 0, True
+                    self._model.train(inputs=np.asarray(samples, np.float32),
+                                      outputs=outputs, sampleWeights=None,
+                                      params=self.__params(self.BATCH_ITER),
+                                      flags=flags)
+            if progress:
+                progress(epoch + 1)
 
     def predict(self, samples):
-        retval, outputs = self._model.predict(samples)
-        return outputs.argmax(-1)
+        return self._predictChunks(lambda chunk: self._model.predict(chunk)[1].argmax(-1),
+                                   samples)
 
 
 class KNN(StatModel):
-
-    def __init__(self, nClass):
+    """K-Nearest Neighbors.
+    Saved models use a compact binary format that is memory-mapped
+    read-only on load, so processes share the same pages:
+    - 32 bytes header (magic, version, sample type, search, k, count,
+      size, recall)
+    - (count, size) uint8, float16 or float32 sample matrix
+    - count int32 responses, aligned on 4 bytes
+    The nearest neighbors search is delegated to one of the indexes of
+    mediocre.neighbors: 'exact' (default), 'cluster' (approximate,
+    see recall) or 'opencv' (cv2.KNearest). It is built by train, and
+    by the first prediction of a loaded model. Version 1 files store
+    neither search nor recall, they load with the defaults.
+    """
+    K = 6
+    SEARCH = 'exact'
+    RECALL = .1
+    MAGIC = 'MKNN'
+    VERSION = 2
+    HEADER = struct.Struct('<4sHBBIQId')
+    HEADER_V1 = struct.Struct('<4sHBxIQI')
+    SEARCHES = ['exact', 'cluster', 'opencv']
+    HEADER_SIZE = 32
+    DTYPES = [np.uint8, np.float16, np.float32]
+
+    def __init__(self, nClass, k=K, search=SEARCH, recall=RECALL):
         super(KNN, self).__init__(nClass)
-        self._model = cv2.KNearest()
+        self.k = k
+        self.search = search
+        self.recall = recall
+        self._samples = np.array([], np.float32)
+        self._responses = np.array([], np.int32)
+        self._buffer = None
+        self._index = None
 
     def train(self, samples, responses, updateBase=False):
-        self._model.train(samples, responses, updateBase=updateBase)
+        if updateBase and self._samples.size:
+            if self._buffer is None:
+                self._buffer = SampleBuffer(self._samples, self._responses)
+            self._buffer.append(samples, responses)
+            samples, responses = self._buffer.samples, self._buffer.responses
+        else:
+            self._buffer = None
+        self._samples = samples
+        self._responses = responses
+        # Built here so that its cost counts as training time.
+        self._index = self.__buildIndex() if len(samples) else None
+
+    def __buildIndex(self):
+        Index = neighbors.INDEXES[self.search]
+        if self.search == 'cluster':
+            return Index(self._samples, self._responses, self.recall)
+        return Index(self._samples, self._responses)
 
     def predict(self, samples):
-        _, results, _, _ = self._model.find_nearest(samples, k=6)
-        return results.ravel()
+        if self._index is None:
+            self._index = self.__buildIndex()
+        responses, distances = self._index.search(samples, self.k)
+        return neighbors.vote(responses, self.classificationCount)
+
+    def __compactType(self, samples):
+        """Smallest sample type able to hold samples without loss.
+        """
+        for code, dtype in enumerate(self.DTYPES):
+            if np.array_equal(samples.astype(dtype), samples):
+                return code, dtype
+        return len(self.DTYPES) - 1, self.DTYPES[-1]
+
+    def save(self, filename):
+        samples = np.asarray(self._samples)
+        responses = np.asarray(self._responses, np.int32)
+        count, size = samples.shape if samples.size else (0, 0)
+        code, dtype = self.__compactType(samples)
+        header = self.HEADER.pack(self.MAGIC, self.VERSION, code,
+                                  self.SEARCHES.index(self.search), self.k,
+                                  count, size, self.recall)
+        samples = np.ascontiguousarray(samples, dtype)
+        folder = os.path.dirname(os.path.abspath(filename))
+        fd, tmp = tempfile.mkstemp(suffix=".tmp", dir=folder)
+        with os.fdopen(fd, 'wb') as file:
+            file.write(header.ljust(self.HEADER_SIZE, '\0'))
+            samples.tofile(file)
+            file.write('\0' * (-samples.nbytes % 4))
+            responses.astype('<i4').tofile(file)
+        # Never write in place: other processes may have the file mapped.
+        os.rename(tmp, filename)
+
+    def load(self, filename):
+        if not os.path.isfile(filename):
+            raise OSError(2, 'File not found', filename)
+        with open(filename, 'rb') as file:
+            header = file.read(self.HEADER_SIZE)
+        if not header.startswith(self.MAGIC):
+            return self.__loadPickle(filename)
+        version, = struct.unpack_from('<H', header, len(self.MAGIC))
+        if version == 1:
+            magic, version, code, k, count, size = self.HEADER_V1.unpack_from(header)
+            search, recall = self.SEARCH, self.RECALL
+        elif version == self.VERSION:
+            magic, version, code, search, k, count, size, recall = \
+                self.HEADER.unpack_from(header)
+            search = self.SEARCHES[search]
+        else:
+            raise ValueError("Unsupported KNN model version {0}".format(version))
+        dtype = np.dtype(self.DTYPES[code])
+        if count:
+            offset = self.HEADER_SIZE
+            self._samples = np.memmap(filename, dtype, 'r', offset, (count, size))
+            offset += self._samples.nbytes + (-self._samples.nbytes % 4)
+            self._responses = np.memmap(filename, '<i4', 'r', offset, (count,))
+        else:
+            self._samples = np.array([], dtype)
+            self._responses = np.array([], np.int32)
+        self.k = k
+        self.search = search
+        self.recall = recall
+        self._buffer = None
+        self._index = None
+
+    def __loadPickle(self, filename):
+        """Load a model saved as a pickled (samples, responses) tuple.
+        """
+        file = open(filename, 'rb')
+        samples, responses = pickle.load(file)
+        file.close()
+        self.train(samples, responses)
 
 
 class SVM(StatModel):
-    BINS_NB = 16
     RESIZE = 20
+    THRESH_BLOCK_SIZE = 11
+    C = 2.67
+    GAMMA = 5.383
+    WARM_START = False
 
-    def __init__(self, nClass):
+    def __init__(self, nClass, C=C, gamma=GAMMA):
         super(SVM, self).__init__(nClass)
+        self.C = C
+        self.gamma = gamma
         self._model = cv2.SVM()
 
-    def preprocess(self, filename):
-        self.input = cv2.imread(filename, 0)
-        self.input = cv2.adaptiveThreshold(src=self.input, maxValue=255,
-                                           adaptiveMethod=cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-                                           thresholdType=cv2.THRESH_BINARY_INV,
-                                           blockSize=11, C=2)
-        self.input = self._ratioResize(self._cropToFit(self.input))
-        self.input = cv2.resize(self.input, (self.RESIZE, self.RESIZE))
-        self.input = self._deskew(self.input)
-        self.input = self._hog(self.input)
-        return np.float32(self.input)
+    def read(self, filename):
+        if not os.path.isfile(filename):
+            raise OSError(2, 'File not found', filename)
+        return cv2.imread(filename, 0)
+
+    def threshold(self, gray):
+        return cv2.adaptiveThreshold(src=gray, maxValue=255,
+                                     adaptiveMethod=cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                                     thresholdType=cv2.THRESH_BINARY_INV,
+                                     blockSize=self.THRESH_BLOCK_SIZE,
+                                     C=self.THRESH_C)
+
+    def normalize(self, binary):
+        return self._deskew(super(SVM, self).normalize(binary))
+
+    def features(self, glyphs):
+        return np.float32(self._hogBatch(glyphs))
 
     def train(self, samples, responses, updateBase=False):
-        if updateBase:
-            if self._samples.any():
-                samples = np.vstack([samples, self._samples])
-                responses = np.append(responses, self._responses)
-            else:
-                return self._model
+        """OpenCV SVMs cannot warm-start (WARM_START is False): an update
+        returns the model unchanged, retrain it on the whole set instead.
+        """
         if updateBase:
             return self._model
         svm_params = dict(kernel_type=cv2.SVM_RBF, svm_type=cv2.SVM_C_SVC,
-                          C=2.67, gamma=5.383)
-        self._samples = samples
-        self._responses = responses
+                          C=self.C, gamma=self.gamma)
         return self._model.train(samples, responses, params=svm_params)
 
     def predict(self, samples):
@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# neighbors.py
+#
+# Author: Yann KOETH
+# Created: Mon Dec  1 10:14:36 2014 (+0100)
+# Last-Updated: Mon Dec  1 16:52:08 2014 (+0100)
+#           By: Yann KOETH
+#     Update #: 118
+#
+
+import cv2
+import numpy as np
+
+
+def mergeNearest(distances, indices, newDistances, newIndices, k):
+    """Keep the k smallest distances of two (N, *) candidate sets.
+    """
+    if distances is not None:
+        newDistances = np.hstack([distances, newDistances])
+        newIndices = np.hstack([indices, newIndices])
+    if newDistances.shape[1] > k:
+        part = np.argpartition(newDistances, k - 1, axis=1)[:, :k]
+        rows = np.arange(len(newDistances))[:, np.newaxis]
+        newDistances = newDistances[rows, part]
+        newIndices = newIndices[rows, part]
+    return newDistances, newIndices
+
+
+def sortNearest(distances, indices):
+    order = np.argsort(distances, axis=1)
+    rows = np.arange(len(distances))[:, np.newaxis]
+    return distances[rows, order], indices[rows, order]
+
+
+def squaredNorms(samples, blockSize=8192):
+    """Squared norms of the samples, converted to float32 by blocks.
+    """
+    norms = np.empty(len(samples), np.float32)
+    for start in xrange(0, len(samples), blockSize):
+        block = np.float32(samples[start:start + blockSize])
+        norms[start:start + len(block)] = np.einsum('ij,ij->i', block, block)
+    return norms
+
+
+class ExactIndex(object):
+    """Brute-force search.
+    Squared distances are computed by blocks of the database as
+    |q|^2 - 2 q.s + |s|^2, the dot products being a single BLAS call,
+    and only the k best candidates of each block are kept.
+    Samples are converted to float32 one block at a time, so a
+    memory-mapped uint8 database is never copied as a whole.
+    """
+    BLOCK_SIZE = 8192
+    QUERY_BLOCK_SIZE = 1024
+
+    def __init__(self, samples, responses):
+        self._samples = samples
+        self._responses = np.asarray(responses)
+        self._norms = squaredNorms(samples, self.BLOCK_SIZE)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def __blocks(self):
+        for start in xrange(0, len(self._samples), self.BLOCK_SIZE):
+            yield start, np.float32(self._samples[start:start + self.BLOCK_SIZE])
+
+    def nearest(self, queries, k):
+        """Returns the (distances, indices) of the k nearest samples.
+        """
+        k = min(k, len(self._samples))
+        distances = np.empty((len(queries), k), np.float32)
+        indices = np.empty((len(queries), k), np.int64)
+        for qStart in xrange(0, len(queries), self.QUERY_BLOCK_SIZE):
+            query = np.float32(queries[qStart:qStart + self.QUERY_BLOCK_SIZE])
+            qNorms = np.einsum('ij,ij->i', query, query)[:, np.newaxis]
+            best = (None, None)
+            for start, block in self.__blocks():
+                d = np.dot(query, block.T)
+                d *= -2
+                d += qNorms
+                d += self._norms[start:start + len(block)]
+                idx = np.arange(start, start + len(block))
+                idx = np.broadcast_to(idx, d.shape)
+                best = mergeNearest(best[0], best[1], d, idx, k)
+            qEnd = qStart + len(query)
+            distances[qStart:qEnd], indices[qStart:qEnd] = sortNearest(*best)
+        return distances, indices
+
+    def search(self, queries, k):
+        """Returns the (responses, distances) of the k nearest samples.
+        """
+        distances, indices = self.nearest(queries, k)
+        return self._responses[indices], np.maximum(distances, 0)
+
+
+class ClusterIndex(object):
+    """Approximate search over k-means clusters of the database.
+    Each query only scans the clusters whose centers are the closest.
+    recall is the fraction of clusters scanned: 1 is an exact search,
+    lower values trade accuracy for speed. Samples are neither copied
+    nor converted, a cluster is converted to float32 when it is scanned.
+    """
+    ITERATIONS = 10
+    TRAINING_SIZE = 64
+
+    def __init__(self, samples, responses, recall=.1, clusters=None, seed=0):
+        count = len(samples)
+        self._recall = recall
+        self._clusterCount = max(1, min(count, clusters or int(np.sqrt(count))))
+        self._centers = self.__kmeans(samples, np.random.RandomState(seed))
+        labels = ExactIndex(self._centers, None).nearest(samples, 1)[1].ravel()
+        order = np.argsort(labels, kind='mergesort')
+        self._order = order
+        # The samples are not reordered: a memory-mapped database stays
+        # shared, each cluster gathers its rows when it is scanned.
+        self._samples = samples
+        self._responses = np.asarray(responses)[order]
+        self._norms = squaredNorms(samples)[order]
+        self._offsets = np.searchsorted(labels[order],
+                                        np.arange(self._clusterCount + 1))
+
+    def __len__(self):
+        return len(self._samples)
+
+    def __kmeans(self, samples, rand):
+        """Lloyd iterations on a random subset of the samples.
+        """
+        size = min(len(samples), self._clusterCount * self.TRAINING_SIZE)
+        subset = np.float32(samples[np.sort(rand.choice(len(samples), size, False))])
+        centers = subset[rand.choice(size, self._clusterCount, False)]
+        for i in xrange(self.ITERATIONS):
+            labels = ExactIndex(centers, None).nearest(subset, 1)[1].ravel()
+            sums = np.zeros_like(centers)
+            np.add.at(sums, labels, subset)
+            counts = np.bincount(labels, minlength=self._clusterCount)
+            filled = counts > 0
+            centers[filled] = sums[filled] / counts[filled][:, np.newaxis]
+        return centers
+
+    def __nearest(self, queries, k):
+        """Returns distances and positions in the clustered order.
+        Missing neighbors, when the scanned clusters hold less than k
+        samples, have an infinite distance and a position of -1.
+        """
+        queries = np.float32(queries)
+        k = min(k, len(self._samples))
+        probes = max(1, int(np.ceil(self._recall * self._clusterCount)))
+        probed = ExactIndex(self._centers, None).nearest(queries, probes)[1]
+        qNorms = np.einsum('ij,ij->i', queries, queries)
+        distances = np.full((len(queries), k), np.inf, np.float32)
+        indices = np.full((len(queries), k), -1, np.int64)
+        # Group the queries by scanned cluster.
+        clusters = probed.ravel()
+        order = np.argsort(clusters, kind='mergesort')
+        queryIds = (order // probed.shape[1])
+        bounds = np.searchsorted(clusters[order], np.arange(self._clusterCount + 1))
+        for cluster in np.unique(clusters):
+            start, end = self._offsets[cluster], self._offsets[cluster + 1]
+            rows = queryIds[bounds[cluster]:bounds[cluster + 1]]
+            if start == end:
+                continue
+            block = np.float32(self._samples[self._order[start:end]])
+            d = np.dot(queries[rows], block.T)
+            d *= -2
+            d += qNorms[rows][:, np.newaxis]
+            d += self._norms[start:end]
+            idx = np.broadcast_to(np.arange(start, end), d.shape)
+            distances[rows], indices[rows] = mergeNearest(distances[rows], indices[rows],
+                                                          d, idx, k)
+        return sortNearest(distances, indices)
+
+    def nearest(self, queries, k):
+        distances, indices = self.__nearest(queries, k)
+        return distances, np.where(indices < 0, -1, self._order[indices])
+
+    def search(self, queries, k):
+        distances, indices = self.__nearest(queries, k)
+        responses = np.where(indices < 0, -1, self._responses[indices])
+        return responses, np.maximum(distances, 0)
+
+
+class OpenCVIndex(object):
+    """cv2.KNearest, the original brute-force implementation.
+    OpenCV keeps its own float32 copy of the samples, memory-mapped
+    models lose their shared pages with it.
+    """
+
+    def __init__(self, samples, responses):
+        self._model = cv2.KNearest()
+        self._model.train(np.float32(samples), np.float32(responses))
+        self._count = len(samples)
+
+    def __len__(self):
+        return self._count
+
+    def search(self, queries, k):
+        _, results, responses, distances = self._model.find_nearest(np.float32(queries), k=k)
+        return responses, distances
+
+
+INDEXES = {
+    'exact': ExactIndex,
+    'cluster': ClusterIndex,
+    'opencv': OpenCVIndex
+}
+
+
+def vote(responses, nClass):
+    """Majority vote on a (N, k) array of neighbor responses.
+    Ties go to the class of the nearest neighbor.
+    Negative responses stand for missing neighbors and do not vote.
+    """
+    count, k = responses.shape
+    responses = np.int64(responses)
+    valid = responses >= 0
+    index = (responses + np.arange(count)[:, np.newaxis] * nClass)[valid]
+    votes = np.bincount(index, minlength=count * nClass)
+    # Rank of the nearest neighbor of every class, k if none.
+    first = np.full(count * nClass, k, np.int64)
+    ranks = np.broadcast_to(np.arange(k), responses.shape)[valid]
+    np.minimum.at(first, index, ranks)
+    scores = votes * (k + 1) + (k - first)
+    return scores.reshape(count, nClass).argmax(axis=1)
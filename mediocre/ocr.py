@@ -10,82 +10,220 @@
 #
 
 import hashlib
+import itertools
 import os
-import pickle
+import random
+import timeit
+from contextlib import closing
 
 import numpy as np
 
-from analyzer import Analyzer
-from mediocre import models
+from mediocre.analyzer import Analyzer
+from mediocre import augment, models
+from mediocre.buffer import SampleBuffer, rebatch
 from mediocre.dataset import DatasetItem
+from mediocre.page import Page
+from mediocre.parallel import parallelMap
+from mediocre.registry import registry
 
 
 class ModelException(Exception):
     pass
 
 
+class TrainingCancelled(Exception):
+    pass
+
+
+class Progress(object):
+    """A training progress event.
+    done out of total units of the current stage, elapsed is the time
+    since training started and eta the estimated time left in the
+    stage (None until a unit is done), in seconds.
+    """
+    PREPROCESS = "preprocess"
+    AUGMENT = "augment"
+    TRAIN = "train"
+    TEST = "test"
+    ERRORS = "errors"
+    DONE = "done"
+
+    def __init__(self, stage, done, total, iteration, elapsed, eta):
+        self.stage = stage
+        self.done = done
+        self.total = total
+        self.iteration = iteration
+        self.elapsed = elapsed
+        self.eta = eta
+
+
 class OCR(object):
     MODEL_ANN = 0
     MODEL_KNN = 1
     MODEL_SVM = 2
+    MODELS = {
+        MODEL_ANN: models.ANN,
+        MODEL_KNN: models.KNN,
+        MODEL_SVM: models.SVM
+    }
+    CHUNK_SIZE = 1024
 
-    def getModelFilename(self, classes, type):
+    def getClassesHash(self, classes):
         values = [cl.value for cl in classes]
         values.sort()
         m = hashlib.md5(''.join(values))
-        return "{0}_{1}.yml".format(m.hexdigest(), type)
+        return m.hexdigest()
 
-    def saveModel(self):
-        root = os.path.dirname(os.path.dirname(__file__))
-        folder = os.path.join(root, "models")
+    def getModelFilename(self, classes, type):
+        return "{0}_{1}.yml".format(self.getClassesHash(classes), type)
+
+    def getModelKey(self, classes, folder, type):
+        """Key of a model in the registry.
+        """
+        return (self.getClassesHash(classes), type,
+                os.path.abspath(folder))
+
+    def saveModel(self, folder=None):
+        """Save the model in folder and return its path.
+        """
+        if folder is None:
+            root = os.path.dirname(os.path.dirname(__file__))
+            folder = os.path.join(root, "models")
         if not os.path.exists(folder):
             os.makedirs(folder)
         filename = self.getModelFilename(self.__classes, self.__type)
-        if not self.__type == self.MODEL_KNN:
-            self.__model.save(os.path.join(folder, filename))
-        else:
-            arr = (self.__dataset.trainSamples,
-                   self.__dataset.trainResponses)
-            file = open(os.path.join(folder, filename), 'wb')
-            pickle.dump(arr, file)
-            file.close()
+        path = os.path.join(folder, filename)
+        self.__model.save(path)
+        key = self.getModelKey(self.__classes, folder, self.__type)
+        registry.put(key, path, self.__model)
+        return path
 
     def loadModel(self, classes, folder, type=MODEL_ANN):
+        """Load a model, or reuse it if it is already resident.
+        """
         self.__classes = classes
+        self.__type = type
         filename = self.getModelFilename(classes, type)
         path = os.path.join(folder, filename)
         if os.path.exists(path):
-            self.__model = self.__initModel(type)
-            if not type == self.MODEL_KNN:
-                self.__model.load(path)
-            else:
-                file = open(path, 'rb')
-                samples, responses = pickle.load(file)
-                file.close()
-                self.__model.train(samples, responses)
+            key = self.getModelKey(classes, folder, type)
+            self.__model = registry.get(key, path,
+                                        lambda path: self.__readModel(type, path))
         else:
             self.__model = None
             raise ModelException()
 
+    def __readModel(self, type, path):
+        model = self.__initModel(type)
+        model.load(path)
+        return model
+
     def trainModel(self, dataset, classes, type=MODEL_ANN, trainRatio=.5,
-                   maxPerClass=100, errorsIteration=0, log=None):
+                   maxPerClass=100, errorsIteration=0, log=None,
+                   workers=1, seed=None, progress=None, cancel=None,
+                   params=None, augmentation=None, memoryBudget=None):
+        """Pre-process the dataset and train a new model.
+        params are the model hyperparameters, as keyword arguments of
+        its constructor. With an augment.AugmentParam, random variants
+        of the train images are generated, pre-processed and added to
+        the train set. The models that can learn by minibatches (ANN)
+        get them batch by batch, new ones at each epoch; the others
+        keep them in memory.
+        With a memoryBudget in bytes, the train and test sets are
+        streamed from the dataset by batches of that size instead of
+        being loaded, for the models that can learn so. Errors are not
+        injected when training by minibatches.
+        progress is called with Progress events. Setting the cancel
+        event (a threading.Event) stops the training at the next
+        event with TrainingCancelled. OpenCV training calls cannot be
+        interrupted, a cancellation waits for them to return.
+        """
         self.__dataset = dataset
         self.__classes = classes
         self.__type = type
+        self.__progress = progress
+        self.__cancel = cancel
+        self.__start = self.__stageStart = timeit.default_timer()
+        self.__stage = None
         if log:
             log("Pre-processing...\n")
-        self.__model = self.__initModel(type)
+        self.__model = self.__initModel(type, params)
+        stream = memoryBudget is not None
+        minibatches = hasattr(self.__model, 'trainStream')
+        if stream and not minibatches:
+            raise ValueError("{0} cannot be trained by minibatches".format(
+                self.__model.__class__.__name__))
         self.__dataset.preprocess(classes, maxPerClass, trainRatio,
-                                  self.__model.preprocess)
-        self.__trainModel(trainRatio=trainRatio, errorsIteration=errorsIteration, log=log)
+                                  self.__model, workers, seed,
+                                  lambda done, total:
+                                  self.__report(Progress.PREPROCESS, done, total),
+                                  stream)
+        if stream or (augmentation and minibatches):
+            self.__trainStream(memoryBudget, augmentation, trainRatio, workers, seed, log)
+        else:
+            if augmentation:
+                self.__augment(augmentation, workers, seed)
+            self.__trainModel(trainRatio=trainRatio, errorsIteration=errorsIteration,
+                              log=log)
+        self.__report(Progress.DONE, 1, 1)
+
+    def __augment(self, param, workers=1, seed=None):
+        """Add the variants of the train images to the train set.
+        """
+        files = self.__dataset.trainFiles
+        buffer = SampleBuffer(self.__dataset.trainSamples, self.__dataset.trainResponses,
+                              len(files) * (1 + param.factor))
+        self.__report(Progress.AUGMENT, 0, len(files))
+        batches = augment.stream(files, self.__dataset.trainResponses, self.__model,
+                                 param, seed, workers)
+        with closing(batches):
+            for samples, responses in batches:
+                buffer.append(samples, responses)
+                self.__report(Progress.AUGMENT, (len(buffer) - len(files)) // param.factor,
+                              len(files))
+        self.__dataset.trainSamples = buffer.samples
+        self.__dataset.trainResponses = buffer.responses
+
+    def __report(self, stage, done, total, iteration=0):
+        """Send a progress event, raise TrainingCancelled if asked to.
+        A finished training is never cancelled.
+        """
+        if (stage != Progress.DONE and self.__cancel is not None and
+                self.__cancel.is_set()):
+            raise TrainingCancelled()
+        if self.__progress:
+            now = timeit.default_timer()
+            if stage != self.__stage:
+                self.__stage, self.__stageStart = stage, now
+            eta = None
+            if done:
+                eta = (now - self.__stageStart) * (total - done) / done
+            self.__progress(Progress(stage, done, total, iteration,
+                                     now - self.__start, eta))
+
+    def evaluateModel(self, dataset, maxPerClass=100, log=None,
+                      workers=1, seed=None):
+        """Evaluate the loaded model on a dataset, used as a test set.
+        Returns the Analyzer.
+        """
+        self.__dataset = dataset
+        if log:
+            log("Pre-processing...\n")
+        self.__dataset.preprocess(self.__classes, maxPerClass, 0,
+                                  self.__model, workers, seed)
+        analyzer = Analyzer(self.__model, self.__dataset, 0)
+        analyzer.analyze()
+        if log:
+            log(str(analyzer))
+        return analyzer
 
     def charFromImage(self, image):
-        item = DatasetItem(self.__model.preprocess)
+        item = DatasetItem(self.__model)
         item.loadFromImage(image)
         return self.__charFromDatasetItem(item).value
 
     def charFromFile(self, filename):
-        item = DatasetItem(self.__model.preprocess)
+        item = DatasetItem(self.__model)
         item.loadFromFile(filename)
         return self.__charFromDatasetItem(item)
 
@@ -94,6 +232,54 @@ class OCR(object):
         response = self.__classes[int(self.__model.predict(sample)[0])]
         return response
 
+    def charsFromFiles(self, filenames, chunkSize=CHUNK_SIZE, workers=1):
+        """Recognize a sequence of image files.
+        Returns the classes in input order.
+        """
+        return self.__charsFromImages(filenames, chunkSize, workers)
+
+    def charsFromArrays(self, images, chunkSize=CHUNK_SIZE, workers=1):
+        """Recognize a (N, H, W) array or a sequence of image arrays.
+        Returns the classes in input order.
+        """
+        return self.__charsFromImages(images, chunkSize, workers)
+
+    def recognizePage(self, image, workers=1):
+        """Recognize the characters of a page or a line (filename or array).
+        The image is thresholded once, glyphs are its connected
+        components grouped in lines and words by geometry, and all of
+        them are predicted at once. Returns a Page.
+        """
+        if isinstance(image, basestring):
+            image = self.__model.read(image)
+        binary = self.__model.threshold(self.__model.grayscale(image))
+        page = Page.segment(binary)
+        glyphs = page.glyphs
+        if glyphs:
+            crops = [binary[y:y + h, x:x + w] for x, y, w, h in
+                     (glyph.box for glyph in glyphs)]
+            normalized = parallelMap(self.__model.normalize, crops, workers)
+            samples = self.__model.features(np.array(normalized))
+            for glyph, response in zip(glyphs, self.__model.predict(samples)):
+                glyph.cl = self.__classes[int(response)]
+        return page
+
+    def __charsFromImages(self, images, chunkSize, workers):
+        """Pre-process images by chunks with a pool of workers,
+        and run a single prediction per chunk.
+        """
+        images = iter(images)
+        chars = []
+        while True:
+            chunk = list(itertools.islice(images, chunkSize))
+            if not chunk:
+                break
+            glyphs = parallelMap(self.__model.glyph, chunk, workers)
+            samples = self.__model.features(np.array(glyphs))
+            chars.extend(self.__classes[int(response)]
+                         for response in self.__model.predict(samples))
+        return chars
+
     def __stackArrays(self, items):
         """Create samples and responses arrays.
         """
@@ -106,40 +292,44 @@ class OCR(object):
             samples.append(item.sample)
         return (np.vstack(samples), np.array(responses))
 
-    def __injectErrors(self, samples, responses):
-        predict = self.__model.predict(samples)
-        errorSamples, errorResponses = [], []
-        goodSamples, goodResponses = [], []
-        for i, error in enumerate(predict != responses):
-            if error:
-                errorSamples.append(samples[i])
-                errorResponses.append(responses[i])
-            else:
-                goodSamples.append(samples[i])
-                goodResponses.append(responses[i])
-        if errorSamples:
-            self.__dataset.trainSamples = np.vstack([self.__dataset.trainSamples, errorSamples])
-            self.__dataset.trainResponses = np.append(self.__dataset.trainResponses, errorResponses)
-            errorSamples = np.vstack(errorSamples)
-            errorResponses = np.array(errorResponses)
-            self.__model.train(errorSamples,
-                               errorResponses, True)
-        if goodSamples:
-            goodSamples = np.vstack(goodSamples)
-        goodResponses = np.array(goodResponses)
-        return goodSamples, goodResponses
+    def __injectErrors(self, samples, responses, injected):
+        """Add the misclassified samples to the injected list and update
+        the model with them, if it can warm-start. Returns the well
+        classified samples.
+        """
+        errors = self.__model.predict(samples) != responses
+        if errors.any():
+            injected.append((samples[errors], responses[errors]))
+            if self.__model.WARM_START:
+                self.__model.train(samples[errors], responses[errors], True)
+        return samples[~errors], responses[~errors], errors.sum()
 
     def __trainModel(self, trainRatio=.5, errorsIteration=0, log=None):
         if log:
             analyzer = Analyzer(self.__model, self.__dataset, trainRatio)
             analyzer.start()
+        self.__report(Progress.TRAIN, 0, 1)
         self.__model.train(self.__dataset.trainSamples,
                            self.__dataset.trainResponses)
+        self.__report(Progress.TRAIN, 1, 1)
         samples, responses = self.__dataset.testSamples, self.__dataset.testResponses
-        i = 0
-        while responses.any() and i < errorsIteration:
-            samples, responses = self.__injectErrors(samples, responses)
-            i += 1
+        if errorsIteration and len(responses):
+            injected = []
+            for i in xrange(errorsIteration):
+                self.__report(Progress.ERRORS, i, errorsIteration, i)
+                samples, responses, errors = self.__injectErrors(samples, responses,
+                                                                 injected)
+                if not errors or not len(responses):
+                    break
+            if injected:
+                injected.insert(0, (self.__dataset.trainSamples,
+                                    self.__dataset.trainResponses))
+                self.__dataset.trainSamples = np.concatenate([s for s, r in injected])
+                self.__dataset.trainResponses = np.concatenate([r for s, r in injected])
+                if not self.__model.WARM_START:
+                    # An unchanged model makes no new error: retrain once.
+                    self.__model.train(self.__dataset.trainSamples,
+                                       self.__dataset.trainResponses)
         self.__dataset.testSamples = samples
         self.__dataset.testResponses = responses
         if log:
@@ -147,13 +337,98 @@ class OCR(object):
             analyzer.analyze()
             log(str(analyzer))
 
-    def __initModel(self, type):
+    def __trainStream(self, budget=None, augmentation=None, trainRatio=.5,
+                      workers=1, seed=None, log=None):
+        """Train the model by minibatches of the train set, streamed or
+        in memory, shuffled differently at each epoch, then test it.
+        Progress is reported in samples over all the epochs.
+        """
+        dataset, model = self.__dataset, self.__model
+        batchSize = model.batchSize(budget) if budget else model.batchSize()
+        epochs = model.EPOCHS
+        factor = augmentation.factor if augmentation else 0
+        count = max(dataset.trainSampleCount, 1) * (1 + factor)
+        if seed is None:
+            seed = random.randrange(2 ** 31)
+        if log:
+            testBatches = None
+            if dataset.streamed:
+                testBatches = lambda: dataset.testBatches(
+                    model, batchSize, workers,
+                    lambda done, total: self.__report(Progress.TEST, done, total))
+            analyzer = Analyzer(model, dataset, trainRatio, testBatches)
+            analyzer.start()
+
+        def batches(epoch):
+            return self.__epochBatches(epoch, epochs, count, batchSize, augmentation,
+                                       workers, seed + epoch)
+
+        self.__report(Progress.TRAIN, 0, epochs * count)
+        model.trainStream(batches, epochs,
+                          lambda epoch: self.__report(Progress.TRAIN, epoch * count,
+                                                      epochs * count, epoch))
+        if log:
+            analyzer.stop()
+            analyzer.analyze()
+            log(str(analyzer))
+
+    def __epochBatches(self, epoch, epochs, count, batchSize, augmentation=None,
+                       workers=1, seed=None):
+        """Generator of the train batches of an epoch. With augmentation,
+        each one is followed by augmentation.factor batches of variants
+        of the shuffled train images. Closing it closes the augmentation
+        pool.
+        """
+        dataset, model = self.__dataset, self.__model
+        rand = np.random.RandomState(seed)
+        loaded = [0, 0]
+
+        def report(images, total=None):
+            loaded[0] = images
+            self.__report(Progress.TRAIN, epoch * count + sum(loaded),
+                          epochs * count, epoch)
+
+        if dataset.streamed:
+            batches = dataset.trainBatches(model, batchSize, workers,
+                                           rand.randint(2 ** 31), report)
+        else:
+            batches = self.__memoryBatches(batchSize, rand, report)
+        factor = augmentation.factor if augmentation else 0
+        variants = iter(())
+        if augmentation:
+            order = rand.permutation(len(dataset.trainFiles))
+            files = [dataset.trainFiles[i] for i in order]
+            variants = rebatch(augment.stream(files, dataset.trainResponses[order], model,
+                                              augmentation, rand.randint(2 ** 31),
+                                              workers), batchSize)
+        try:
+            for batch in batches:
+                yield batch
+                for batch in itertools.islice(variants, factor):
+                    loaded[1] += len(batch[0])
+                    report(loaded[0])
+                    yield batch
+            for batch in variants:
+                loaded[1] += len(batch[0])
+                report(loaded[0])
+                yield batch
+        finally:
+            batches.close()
+            if augmentation:
+                variants.close()
+
+    def __memoryBatches(self, batchSize, rand, progress):
+        """Yield the in-memory train set in random batches of batchSize.
+        """
+        samples, responses = self.__dataset.trainSamples, self.__dataset.trainResponses
+        order = rand.permutation(len(samples))
+        for start in xrange(0, len(order), batchSize):
+            index = order[start:start + batchSize]
+            progress(start + len(index))
+            yield samples[index], responses[index]
+
+    def __initModel(self, type, params=None):
         """Instanciate the choosen model.
         """
-        mods = {
-            self.MODEL_ANN: models.ANN,
-            self.MODEL_KNN: models.KNN,
-            self.MODEL_SVM: models.SVM
-        }
-        Model = mods[type]
-        return Model(len(self.__classes))
+        Model = self.MODELS[type]
+        return Model(len(self.__classes), **(params or {}))
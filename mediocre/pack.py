@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# pack.py
+#
+# Author: Yann KOETH
+# Created: Mon Dec  8 09:36:50 2014 (+0100)
+# Last-Updated: Mon Dec  8 15:12:27 2014 (+0100)
+#           By: Yann KOETH
+#     Update #: 94
+#
+
+"""Packed storage of the images of a class in a single file.
+
+A pack is a 16 bytes header (magic, version, slot height and width)
+followed by fixed-size records: the height and width of the image
+(2 uint16) and a slot of height x width uint8 pixels holding it in
+its top left corner. Record i is at a known offset, so the file is
+memory-mapped and read at random; the count follows from its size.
+
+Slots are sized from the images present when the pack is created. A
+larger image appended later is shrunk to fit, keeping its aspect
+ratio, so its features differ from those of the same image stored as
+a file; this is logged.
+
+Packs are never truncated or rewritten in place, other processes may
+have them mapped. A deleted record is a tombstone of height 0, skipped
+by entries.
+"""
+
+import hashlib
+import os
+import struct
+
+import cv2
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+EXT = ".pack"
+IMAGE_EXT = [".bmp", ".png"]
+
+
+class PackException(Exception):
+    pass
+
+
+class ClassPack(object):
+    MAGIC = 'MPCK'
+    VERSION = 1
+    HEADER = struct.Struct('<4sHHH')
+    HEADER_SIZE = 16
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as file:
+            header = file.read(self.HEADER_SIZE)
+        if len(header) < self.HEADER_SIZE:
+            raise PackException("Truncated pack {0}".format(path))
+        magic, version, height, width = self.HEADER.unpack_from(header)
+        if magic != self.MAGIC or version != self.VERSION:
+            raise PackException("Not a version {0} pack: {1}".format(self.VERSION, path))
+        self.slot = (height, width)
+        self.dtype = np.dtype([('height', '<u2'), ('width', '<u2'),
+                               ('pixels', np.uint8, self.slot)])
+        self._records = None
+        self._count = 0
+
+    @classmethod
+    def create(cls, path, height, width):
+        """Create an empty pack of height x width slots.
+        """
+        header = cls.HEADER.pack(cls.MAGIC, cls.VERSION, height, width)
+        fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        with os.fdopen(fd, 'wb') as file:
+            file.write(header.ljust(cls.HEADER_SIZE, '\0'))
+        return cls(path)
+
+    def __len__(self):
+        size = os.path.getsize(self.path) - self.HEADER_SIZE
+        return size // self.dtype.itemsize
+
+    def __records(self):
+        """Memory map of the records, remapped when the pack grew.
+        """
+        count = len(self)
+        if self._records is None or count != self._count:
+            self._count = count
+            self._records = None
+            if count:
+                self._records = np.memmap(self.path, self.dtype, 'r',
+                                          self.HEADER_SIZE, (count,))
+        return self._records
+
+    def __record(self, index):
+        if not 0 <= index < self._count:
+            self.__records()
+        if not 0 <= index < self._count:
+            raise IndexError(index)
+        return self._records[index]
+
+    def __getitem__(self, index):
+        record = self.__record(index)
+        if not record['height']:
+            raise PackException("Deleted record {0} of {1}".format(index, self.path))
+        return np.array(record['pixels'][:record['height'], :record['width']])
+
+    def indexes(self):
+        """Indexes of the records that are not deleted.
+        """
+        records = self.__records()
+        if records is None:
+            return []
+        return np.flatnonzero(records['height']).tolist()
+
+    def digest(self, index):
+        """Hash of the content of a record, a cache key surviving appends.
+        """
+        return hashlib.md5(self.__record(index).tostring()).hexdigest()
+
+    def fit(self, image):
+        """Shrink a grayscale image to fit a slot, keeping its aspect ratio.
+        """
+        height, width = image.shape
+        scale = min(1., self.slot[0] / float(height), self.slot[1] / float(width))
+        if scale < 1:
+            print "Shrink {0}x{1} image to the {2}x{3} slots of {4}".format(
+                height, width, self.slot[0], self.slot[1], self.path)
+            size = (max(1, int(width * scale)), max(1, int(height * scale)))
+            image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+        return image
+
+    def append(self, image):
+        """Append a grayscale image, returns its index.
+        Writers lock the file, so several processes can append.
+        """
+        image = self.fit(image)
+        record = np.zeros(1, self.dtype)
+        record['height'], record['width'] = image.shape
+        record['pixels'][0, :image.shape[0], :image.shape[1]] = image
+        with open(self.path, 'ab') as file:
+            if fcntl:
+                fcntl.flock(file, fcntl.LOCK_EX)
+            try:
+                file.seek(0, os.SEEK_END)
+                index = (file.tell() - self.HEADER_SIZE) // self.dtype.itemsize
+                file.write(record.tostring())
+                file.flush()
+            finally:
+                if fcntl:
+                    fcntl.flock(file, fcntl.LOCK_UN)
+        return index
+
+    def delete(self, index):
+        """Mark a record as deleted by zeroing its height in place.
+        The file keeps its size, so its memory maps stay valid.
+        """
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        with open(self.path, 'r+b') as file:
+            file.seek(self.HEADER_SIZE + index * self.dtype.itemsize)
+            file.write(struct.pack('<H', 0))
+
+
+_packs = {}
+
+
+def openPack(path):
+    """Open a pack once per process, again if the file was replaced.
+    """
+    inode = os.stat(path).st_ino
+    cached = _packs.get(path)
+    if cached is None or cached[1] != inode:
+        cached = _packs[path] = (ClassPack(path), inode)
+    return cached[0]
+
+
+class PackEntry(object):
+    """An image of a pack, usable in place of an image filename.
+    """
+
+    def __init__(self, path, index):
+        self.path = path
+        self.index = index
+
+    def __key(self):
+        return (self.path, self.index)
+
+    def __eq__(self, other):
+        return isinstance(other, PackEntry) and self.__key() == other.__key()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __lt__(self, other):
+        return self.__key() < other.__key()
+
+    def __hash__(self):
+        return hash(self.__key())
+
+    def __repr__(self):
+        return "{0}#{1}".format(self.path, self.index)
+
+    def read(self):
+        return openPack(self.path)[self.index]
+
+    def digest(self):
+        return openPack(self.path).digest(self.index)
+
+
+def packPath(folder, name):
+    return os.path.join(folder, name + EXT)
+
+
+def entries(path):
+    return [PackEntry(path, i) for i in openPack(path).indexes()]
+
+
+def readImage(model, image):
+    """Read a filename with the model, or a PackEntry.
+    """
+    if isinstance(image, PackEntry):
+        return image.read()
+    return model.read(image)
+
+
+def _images(folder):
+    return sorted(os.path.join(folder, file) for file in os.listdir(folder)
+                  if os.path.splitext(file)[1].lower() in IMAGE_EXT)
+
+
+def packFolder(root, remove=False, log=None):
+    """Pack every class folder of a dataset into root/<folder>.pack.
+    Slots fit the largest image of each class. The images are
+    removed once packed if remove is set.
+    """
+    for name in sorted(os.listdir(root)):
+        folder = os.path.join(root, name)
+        if not os.path.isdir(folder):
+            continue
+        images = _images(folder)
+        if not images:
+            continue
+        path = packPath(root, name)
+        if os.path.exists(path):
+            raise PackException("{0} already exists".format(path))
+        grays = [cv2.imread(image, 0) for image in images]
+        for image, gray in zip(images, grays):
+            if gray is None:
+                raise PackException("Cannot read {0}".format(image))
+        slot = np.max([gray.shape for gray in grays], axis=0)
+        pack = ClassPack.create(path, *slot)
+        for gray in grays:
+            pack.append(gray)
+        if log:
+            log("{0}: {1} images\n".format(path, len(grays)))
+        if remove:
+            for image in images:
+                os.remove(image)
+
+
+def unpackFolder(root, format="bmp", remove=False, log=None):
+    """Write the images of every pack of a dataset back to
+    root/<folder>/<folder>.<i>.<format> files.
+    """
+    for file in sorted(os.listdir(root)):
+        name, ext = os.path.splitext(file)
+        if ext != EXT:
+            continue
+        path = os.path.join(root, file)
+        folder = os.path.join(root, name)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        pack = ClassPack(path)
+        indexes = pack.indexes()
+        for i in indexes:
+            cv2.imwrite(os.path.join(folder, "{0}.{1}.{2}".format(name, i, format)),
+                        pack[i])
+        if log:
+            log("{0}: {1} images\n".format(folder, len(indexes)))
+        if remove:
+            _packs.pop(path, None)
+            os.remove(path)
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# page.py
+#
+# Author: Yann KOETH
+# Created: Tue Dec  2 09:47:11 2014 (+0100)
+# Last-Updated: Tue Dec  2 15:20:58 2014 (+0100)
+#           By: Yann KOETH
+#     Update #: 87
+#
+
+import cv2
+import numpy as np
+
+
+class Glyph(object):
+    """A glyph found on a page, box is (x, y, w, h).
+    """
+
+    def __init__(self, box):
+        self.box = box
+        self.cl = None
+
+
+class Page(object):
+    """Glyphs of a page, as lines of words of glyphs.
+    """
+    MIN_AREA = 4
+    LINE_OVERLAP = .5
+    LINE_DISTANCE = .5
+    MERGE_OVERLAP = .5
+    WORD_SPACING = .4
+
+    def __init__(self, lines=None):
+        self.lines = lines or []
+
+    @property
+    def glyphs(self):
+        return [glyph for line in self.lines for word in line for glyph in word]
+
+    @property
+    def text(self):
+        return '\n'.join(' '.join(''.join(glyph.cl.value if glyph.cl else '?'
+                                          for glyph in word)
+                                  for word in line)
+                         for line in self.lines)
+
+    @classmethod
+    def segment(cls, binary):
+        """Find the glyphs of a black and white image (white ink).
+        """
+        contours, hierarchy = cv2.findContours(binary.copy(), cv2.RETR_EXTERNAL,
+                                               cv2.CHAIN_APPROX_SIMPLE)
+        boxes = [cv2.boundingRect(cnt) for cnt in contours]
+        boxes = [box for box in boxes if box[2] * box[3] >= cls.MIN_AREA]
+        lines = []
+        for boxes in cls.__groupLines(boxes):
+            boxes = cls.__mergeBoxes(boxes)
+            lines.append([[Glyph(box) for box in word]
+                          for word in cls.__groupWords(boxes)])
+        return cls(lines)
+
+    @classmethod
+    def __groupLines(cls, boxes):
+        """Group boxes by vertical overlap.
+        Tallest boxes are placed first so small marks (dots, commas)
+        join the lines they belong to, or the closest one.
+        """
+        lines = []
+        for box in sorted(boxes, key=lambda box: -box[3]):
+            x, y, w, h = box
+            line = cls.__overlappingLine(lines, box) or cls.__closestLine(lines, box)
+            if line:
+                line[0], line[1] = min(line[0], y), max(line[1], y + h)
+                line[2].append(box)
+            else:
+                lines.append([y, y + h, [box]])
+        lines.sort(key=lambda line: line[0])
+        return [line[2] for line in lines]
+
+    @classmethod
+    def __overlappingLine(cls, lines, box):
+        """Line overlapping most with box, if by LINE_OVERLAP of its height.
+        """
+        x, y, w, h = box
+        best, bestOverlap = None, cls.LINE_OVERLAP * h
+        for line in lines:
+            overlap = min(y + h, line[1]) - max(y, line[0])
+            if overlap >= bestOverlap:
+                best, bestOverlap = line, overlap
+        return best
+
+    @classmethod
+    def __closestLine(cls, lines, box):
+        """Closest line to a small box, within LINE_DISTANCE of the line height.
+        """
+        x, y, w, h = box
+        best, bestDistance = None, None
+        for line in lines:
+            height = line[1] - line[0]
+            distance = max(0, line[0] - (y + h), y - line[1])
+            if (h <= cls.LINE_DISTANCE * height and
+                    distance <= cls.LINE_DISTANCE * height and
+                    (best is None or distance < bestDistance)):
+                best, bestDistance = line, distance
+        return best
+
+    @classmethod
+    def __mergeBoxes(cls, boxes):
+        """Merge boxes of a line stacked on each other (i, j, :, ;, ...).
+        Returns the merged boxes sorted from left to right.
+        """
+        merged = []
+        for box in sorted(boxes):
+            x, y, w, h = box
+            if merged:
+                pX, pY, pW, pH = merged[-1]
+                overlap = min(x + w, pX + pW) - max(x, pX)
+                if overlap >= cls.MERGE_OVERLAP * min(w, pW):
+                    bbX, bbY = min(x, pX), min(y, pY)
+                    merged[-1] = (bbX, bbY,
+                                  max(x + w, pX + pW) - bbX,
+                                  max(y + h, pY + pH) - bbY)
+                    continue
+            merged.append(box)
+        return merged
+
+    @classmethod
+    def __groupWords(cls, boxes):
+        """Split a line where the gap between glyphs is wider than
+        WORD_SPACING times the median glyph height.
+        """
+        spacing = cls.WORD_SPACING * np.median([h for x, y, w, h in boxes])
+        words = [[boxes[0]]]
+        for box in boxes[1:]:
+            pX, pY, pW, pH = words[-1][-1]
+            if box[0] - (pX + pW) > spacing:
+                words.append([])
+            words[-1].append(box)
+        return words
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# parallel.py
+#
+# Author: Yann KOETH
+# Created: Fri Nov 28 14:02:19 2014 (+0100)
+# Last-Updated: Fri Nov 28 15:26:50 2014 (+0100)
+#           By: Yann KOETH
+#     Update #: 21
+#
+
+import itertools
+from collections import deque
+from multiprocessing import Pool, cpu_count
+from multiprocessing.pool import ThreadPool
+
+
+def workerCount(workers=None):
+    """Returns the number of workers to use, defaults to the number of cores.
+    """
+    if not workers:
+        try:
+            return cpu_count()
+        except NotImplementedError:
+            return 1
+    return max(1, workers)
+
+
+def chunkSize(count, workers):
+    """Split count jobs in about 4 chunks per worker.
+    """
+    return max(1, -(-count // (workers * 4)))
+
+
+def parallelMap(func, items, workers=1):
+    """Apply func to every item and return the results in input order.
+    Uses a pool of threads: OpenCV releases the GIL while it works,
+    and bound methods cannot be pickled to worker processes.
+    """
+    items = list(items)
+    if workers <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+    pool = ThreadPool(min(workers, len(items)))
+    try:
+        return pool.map(func, items, chunkSize(len(items), workers))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def processMap(func, items, workers=1, initializer=None, initargs=()):
+    """Apply a module level func to every item in a pool of processes,
+    and return the results in input order. initializer(*initargs) runs
+    once in each worker; with fork, initargs are inherited, not copied.
+    """
+    items = list(items)
+    if workers <= 1 or len(items) <= 1:
+        if initializer:
+            initializer(*initargs)
+        return [func(item) for item in items]
+    pool = Pool(min(workers, len(items)), initializer, initargs)
+    try:
+        return pool.map(func, items, 1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def processImap(func, items, workers=1):
+    """Lazily apply a module level func to every item in a pool of
+    processes, yielding the results in input order.
+    At most 2 * workers items are in flight, so a slow consumer keeps
+    few results in memory. Close the generator to stop the pool early.
+    """
+    if workers <= 1:
+        for item in items:
+            yield func(item)
+        return
+    items = iter(items)
+    pool = Pool(workers)
+    try:
+        pending = deque(pool.apply_async(func, (item,))
+                        for item in itertools.islice(items, 2 * workers))
+        while pending:
+            result = pending.popleft().get()
+            for item in itertools.islice(items, 1):
+                pending.append(pool.apply_async(func, (item,)))
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# profiling.py
+#
+# Author: Yann KOETH
+# Created: Sat Dec  6 10:17:33 2014 (+0100)
+# Last-Updated: Sat Dec  6 12:40:05 2014 (+0100)
+#           By: Yann KOETH
+#     Update #: 46
+#
+
+"""Opt-in timing of the pre-processing stages of the models.
+
+    from mediocre import profiling
+    profiling.enable()
+    ...
+    print profiling.report()
+
+Setting the MEDIOCRE_PROFILE environment variable enables it when the
+models are imported. Enabling wraps the stage methods of the model
+classes, disabling restores them: a disabled profiler costs nothing.
+Each process, such as a cross-validation worker, has its own totals.
+"""
+
+import functools
+import os
+import threading
+import timeit
+from collections import OrderedDict
+
+from mediocre import models
+
+ENV = "MEDIOCRE_PROFILE"
+CLASSES = (models.StatModel, models.ANN, models.KNN, models.SVM)
+STAGES = ('glyph', 'read', 'grayscale', 'threshold', 'normalize', '_cropToFit',
+          '_ratioResize', '_deskew', 'features', '_hogBatch')
+
+_lock = threading.Lock()
+_local = threading.local()
+_originals = {}
+_stats = {}
+
+
+def _record(name, elapsed, own):
+    with _lock:
+        stat = _stats.get(name)
+        if stat is None:
+            stat = _stats[name] = [0, 0., 0.]
+        stat[0] += 1
+        stat[1] += elapsed
+        stat[2] += own
+
+
+def _timed(name, func):
+    """Wrap func to accumulate its calls, total time and own time,
+    which excludes the time spent in the stages it calls.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+        stack.append(0.)
+        start = timeit.default_timer()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = timeit.default_timer() - start
+            children = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            _record(name, elapsed, elapsed - children)
+    return wrapper
+
+
+def enabled():
+    return bool(_originals)
+
+
+def enable():
+    """Start timing the stages defined by the model classes.
+    """
+    if enabled():
+        return
+    for cls in CLASSES:
+        for stage in STAGES:
+            func = vars(cls).get(stage)
+            if func is not None:
+                _originals[(cls, stage)] = func
+                name = "{0}.{1}".format(cls.__name__, stage.lstrip('_'))
+                setattr(cls, stage, _timed(name, func))
+
+
+def disable():
+    """Restore the original stages, the totals are kept.
+    """
+    for (cls, stage), func in _originals.items():
+        setattr(cls, stage, func)
+    _originals.clear()
+
+
+def reset():
+    with _lock:
+        _stats.clear()
+
+
+def stats():
+    """Returns {stage: (calls, total time, own time)}, times in seconds,
+    by decreasing own time.
+    """
+    with _lock:
+        items = [(name, tuple(stat)) for name, stat in _stats.items()]
+    items.sort(key=lambda item: -item[1][2])
+    return OrderedDict(items)
+
+
+def report():
+    res = "\n  {0:<24}{1:>10}{2:>12}{3:>12}{4:>14}\n".format(
+        "Stage", "Calls", "Total (s)", "Own (s)", "Own/call (ms)")
+    for name, (calls, total, own) in stats().items():
+        res += "  {0:<24}{1:>10}{2:>12.4f}{3:>12.4f}{4:>14.4f}\n".format(
+            name, calls, total, own, own * 1000 / calls)
+    return res
+
+
+if os.environ.get(ENV):
+    enable()
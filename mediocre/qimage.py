@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# qimage.py
+#
+# Author: Yann KOETH
+# Created: Sat Nov 29 16:21:07 2014 (+0100)
+# Last-Updated: Sat Nov 29 17:48:32 2014 (+0100)
+#           By: Yann KOETH
+#     Update #: 29
+#
+
+import numpy as np
+from PyQt5.QtGui import QImage, QPixmap
+
+
+class ImageBuffer(object):
+    """Expose the bits of a 32 bits QImage through the array interface.
+    The buffer keeps a reference to the image, so arrays built on top
+    of it stay valid as long as they are alive.
+    """
+    FORMATS = (QImage.Format_RGB32, QImage.Format_ARGB32,
+               QImage.Format_ARGB32_Premultiplied)
+
+    def __init__(self, image):
+        if image.format() not in self.FORMATS:
+            image = image.convertToFormat(QImage.Format_RGB32)
+        self.image = image
+        self.bits = image.constBits()
+        self.bits.setsize(image.byteCount())
+        self.__array_interface__ = {
+            'version': 3,
+            'typestr': '|u1',
+            'shape': (image.height(), image.width(), 4),
+            'strides': (image.bytesPerLine(), 4, 1),
+            'data': (int(self.bits), True)
+        }
+
+
+def imageToArray(image):
+    """Returns a read-only (H, W, 4) view over a QImage or QPixmap.
+    32 bits images are stored as 0xAARRGGBB words, so on little-endian
+    machines the channels are in OpenCV's BGRA order.
+    """
+    if isinstance(image, QPixmap):
+        image = image.toImage()
+    return np.asarray(ImageBuffer(image))
+
+
+def arrayToPixmap(array):
+    """Returns a QPixmap copy of a (H, W) grayscale uint8 array.
+    """
+    rgb = np.ascontiguousarray(np.repeat(array[:, :, np.newaxis], 3, axis=2))
+    height, width = array.shape
+    image = QImage(rgb.data, width, height, width * 3, QImage.Format_RGB888)
+    return QPixmap.fromImage(image.copy())
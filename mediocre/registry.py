@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# registry.py
+#
+# Author: Yann KOETH
+# Created: Sun Nov 30 11:05:52 2014 (+0100)
+# Last-Updated: Sun Nov 30 12:31:14 2014 (+0100)
+#           By: Yann KOETH
+#     Update #: 44
+#
+
+import os
+import threading
+from collections import OrderedDict
+
+
+class ModelRegistry(object):
+    """Process-wide store of loaded models.
+    Models are keyed by (classes hash, model type, folder) and the
+    modification time of their file, so a model saved again is
+    reloaded. The least recently used models are evicted when the
+    total size exceeds maxSize (file sizes are used as an estimate).
+    """
+    MAX_SIZE = 256 * 1024 * 1024
+
+    def __init__(self, maxSize=MAX_SIZE):
+        self._maxSize = maxSize
+        self._models = OrderedDict()
+        self._size = 0
+        self._lock = threading.RLock()
+
+    def maxSize(self):
+        return self._maxSize
+
+    def setMaxSize(self, maxSize):
+        with self._lock:
+            self._maxSize = maxSize
+            self.__evict()
+
+    def __len__(self):
+        return len(self._models)
+
+    def __stamp(self, path):
+        stat = os.stat(path)
+        return (stat.st_mtime, stat.st_size)
+
+    def get(self, key, path, load):
+        """Returns the model stored in path.
+        The model is loaded with load(path) if it is not resident or if
+        the file changed since it was loaded.
+        """
+        stamp = self.__stamp(path)
+        with self._lock:
+            entry = self._models.pop(key, None)
+            if entry and entry[1] == stamp:
+                self._models[key] = entry
+                return entry[0]
+            if entry:
+                self._size -= entry[1][1]
+        return self.put(key, path, load(path))
+
+    def put(self, key, path, model):
+        """Register a model which has just been loaded from or saved to path.
+        """
+        stamp = self.__stamp(path)
+        with self._lock:
+            self.invalidate(key)
+            self._models[key] = (model, stamp)
+            self._size += stamp[1]
+            self.__evict()
+        return model
+
+    def invalidate(self, key):
+        with self._lock:
+            entry = self._models.pop(key, None)
+            if entry:
+                self._size -= entry[1][1]
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+            self._size = 0
+
+    def __evict(self):
+        """Drop least recently used models, always keep the last one.
+        """
+        while self._size > self._maxSize and len(self._models) > 1:
+            key, (model, stamp) = self._models.popitem(last=False)
+            self._size -= stamp[1]
+
+
+registry = ModelRegistry()
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# tuning.py
+#
+# Author: Yann KOETH
+# Created: Fri Dec  5 09:48:22 2014 (+0100)
+# Last-Updated: Fri Dec  5 13:15:40 2014 (+0100)
+#           By: Yann KOETH
+#     Update #: 71
+#
+
+import itertools
+import json
+import os
+import random
+import timeit
+from collections import OrderedDict
+
+import numpy as np
+
+from mediocre.ocr import OCR
+from mediocre.parallel import processMap
+from mediocre.validation import pipelineFeatures
+
+SPACES = {
+    OCR.MODEL_ANN: OrderedDict([('hidden', [8, 16, 32, 64]),
+                                ('maxIter', [500, 2000]),
+                                ('epsilon', [0.002, 0.0005])]),
+    OCR.MODEL_KNN: OrderedDict([('k', [1, 3, 6, 10]),
+                                ('search', ['exact', 'cluster'])]),
+    OCR.MODEL_SVM: OrderedDict([('C', [0.5, 2.67, 10, 50]),
+                                ('gamma', [0.5, 1.5, 5.383, 10])])
+}
+
+_state = {}
+
+
+def _initWorker(features, trainResponses, testResponses, nClass):
+    _state.update(features=features, trainResponses=trainResponses,
+                  testResponses=testResponses, nClass=nClass)
+
+
+def _runTrial(job):
+    type, params = job
+    trainSamples, testSamples = _state['features'][type]
+    testResponses = _state['testResponses']
+    model = OCR.MODELS[type](_state['nClass'], **params)
+    start = timeit.default_timer()
+    model.train(trainSamples, _state['trainResponses'])
+    trainTime = timeit.default_timer() - start
+    start = timeit.default_timer()
+    predict = model.predict(testSamples)
+    predictTime = (timeit.default_timer() - start) / max(len(testSamples), 1)
+    accuracy = np.mean(np.int64(predict).ravel() == testResponses)
+    return Trial(type, params, accuracy, trainTime, predictTime)
+
+
+def grid(space):
+    """Every configuration of a {name: values} space.
+    """
+    names = list(space)
+    return [dict(zip(names, values))
+            for values in itertools.product(*[space[name] for name in names])]
+
+
+def randomConfigs(space, count, rand):
+    """count distinct configurations drawn from the grid of space.
+    """
+    configs = grid(space)
+    picked = rand.choice(len(configs), min(count, len(configs)), replace=False)
+    return [configs[i] for i in sorted(picked)]
+
+
+class Trial(object):
+    """A configuration and its test accuracy, training time and
+    prediction time per sample, in seconds.
+    """
+
+    def __init__(self, type, params, accuracy, trainTime, predictTime):
+        self.type = type
+        self.params = params
+        self.accuracy = accuracy
+        self.trainTime = trainTime
+        self.predictTime = predictTime
+
+    def dominates(self, other):
+        """Better or as good on every objective, and strictly better on one.
+        """
+        mine = (-self.accuracy, self.trainTime, self.predictTime)
+        theirs = (-other.accuracy, other.trainTime, other.predictTime)
+        return (all(a <= b for a, b in zip(mine, theirs)) and
+                any(a < b for a, b in zip(mine, theirs)))
+
+    def toDict(self):
+        return OrderedDict([('type', self.type), ('params', self.params),
+                            ('accuracy', float(self.accuracy)),
+                            ('trainTime', float(self.trainTime)),
+                            ('predictTime', float(self.predictTime))])
+
+
+def paretoFront(trials):
+    """Trials no other trial dominates.
+    """
+    return [trial for trial in trials
+            if not any(other.dominates(trial) for other in trials)]
+
+
+def best(trials, target=None):
+    """The most accurate trial of the Pareto front or, given a target
+    accuracy, the fastest to predict among those reaching it.
+    """
+    front = paretoFront(trials)
+    if target is not None:
+        reached = [trial for trial in front if trial.accuracy >= target]
+        if reached:
+            return min(reached, key=lambda trial: (trial.predictTime, trial.trainTime))
+    return max(front, key=lambda trial: (trial.accuracy, -trial.predictTime))
+
+
+class Search(object):
+    """Grid or random search of the hyperparameters of models.
+    Features are computed once per pre-processing pipeline, through
+    the dataset feature cache, and configurations are trained and
+    tested on a hold-out set by a pool of processes.
+    """
+
+    def __init__(self, dataset, classes, trainRatio=.5, maxPerClass=100,
+                 workers=1, seed=None):
+        self._dataset = dataset
+        self._classes = classes
+        self._trainRatio = trainRatio
+        self._maxPerClass = maxPerClass
+        self._workers = workers
+        self._seed = seed
+        if self._seed is None:
+            self._seed = random.randrange(2 ** 31)
+
+    def run(self, types, trials=None, spaces=SPACES, log=None):
+        """Search the spaces of the model types, the whole grid or
+        trials random configurations per type. Returns the Trials.
+        """
+        rand = np.random.RandomState(self._seed)
+        jobs = []
+        for type in types:
+            if trials:
+                configs = randomConfigs(spaces[type], trials, rand)
+            else:
+                configs = grid(spaces[type])
+            jobs.extend((type, params) for params in configs)
+        features, trainResponses, testResponses = pipelineFeatures(
+            self._dataset, self._classes, types, self._maxPerClass,
+            self._trainRatio, self._workers, self._seed, log)
+        if log:
+            log("Trying {0} configurations...\n".format(len(jobs)))
+        args = (features, trainResponses, testResponses, len(self._classes))
+        results = processMap(_runTrial, jobs, self._workers, _initWorker, args)
+        _state.clear()
+        return results
+
+    def save(self, trial, trials, folder=None, log=None):
+        """Train the model of a trial on the train set and save it,
+        with a report of the search next to it. Returns the model path.
+        """
+        ocr = OCR()
+        ocr.trainModel(self._dataset, self._classes, trial.type, self._trainRatio,
+                       self._maxPerClass, 0, None, self._workers, self._seed,
+                       params=trial.params)
+        path = ocr.saveModel(folder)
+        report = OrderedDict([('best', trial.toDict()),
+                              ('pareto', [t.toDict() for t in paretoFront(trials)]),
+                              ('trials', [t.toDict() for t in trials])])
+        with open(os.path.splitext(path)[0] + ".tuning.json", 'w') as file:
+            json.dump(report, file, indent=2)
+        if log:
+            log("Saved {0}\n".format(path))
+        return path
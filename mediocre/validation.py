@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# validation.py
+#
+# Author: Yann KOETH
+# Created: Thu Dec  4 14:02:51 2014 (+0100)
+# Last-Updated: Thu Dec  4 16:37:15 2014 (+0100)
+#           By: Yann KOETH
+#     Update #: 64
+#
+
+import random
+import timeit
+from collections import OrderedDict
+
+import numpy as np
+
+from mediocre.analyzer import confusionMatrix, scores
+from mediocre.ocr import OCR
+from mediocre.parallel import processMap
+
+_state = {}
+
+
+def _initWorker(features, responses, folds, nClass):
+    """Share the data with a worker, inherited without copy on fork.
+    """
+    _state.update(features=features, responses=responses,
+                  folds=folds, nClass=nClass)
+
+
+def _runFold(job):
+    """Train a model on all folds but one and test it on that one.
+    Returns (type, fold, training time, confusion matrix).
+    """
+    type, fold = job
+    samples, responses = _state['features'][type], _state['responses']
+    test = _state['folds'][fold]
+    train = np.ones(len(responses), np.bool_)
+    train[test] = False
+    model = OCR.MODELS[type](_state['nClass'])
+    start = timeit.default_timer()
+    model.train(samples[train], responses[train])
+    trainTime = timeit.default_timer() - start
+    matrix = confusionMatrix(responses[test], model.predict(samples[test]),
+                             _state['nClass'])
+    return type, fold, trainTime, matrix
+
+
+def pipelineFeatures(dataset, classes, types, maxPerClass, trainRatio,
+                     workers=1, seed=None, log=None):
+    """Pre-process the dataset once per pipeline, ANN and KNN share theirs.
+    Returns {type: (trainSamples, testSamples)}, the train responses
+    and the test responses. The seed must be set for all the
+    pipelines to select the same images.
+    """
+    features, pipelines = {}, {}
+    for type in types:
+        model = OCR.MODELS[type](len(classes))
+        fingerprint = model.fingerprint()
+        if fingerprint not in pipelines:
+            if log:
+                log("Pre-processing...\n")
+            dataset.preprocess(classes, maxPerClass, trainRatio, model, workers, seed)
+            pipelines[fingerprint] = (dataset.trainSamples, dataset.testSamples)
+        features[type] = pipelines[fingerprint]
+    return (features, np.int32(dataset.trainResponses),
+            np.int32(dataset.testResponses))
+
+
+def kFolds(count, k, rand):
+    """Split count sample indices in k random folds.
+    """
+    return [np.sort(fold) for fold in np.array_split(rand.permutation(count), k)]
+
+
+def stratifiedFolds(responses, k, rand):
+    """Split sample indices in k folds with the class proportions
+    of the whole set.
+    """
+    folds = [[] for i in xrange(k)]
+    offset = 0
+    for cl in np.unique(responses):
+        indices = np.flatnonzero(responses == cl)
+        rand.shuffle(indices)
+        positions = (offset + np.arange(len(indices))) % k
+        for i in xrange(k):
+            folds[i].append(indices[positions == i])
+        offset += len(indices)
+    return [np.sort(np.concatenate(fold)) for fold in folds]
+
+
+class FoldResults(object):
+    """Accuracy and training time of a model over the folds.
+    """
+
+    def __init__(self, type, nClass):
+        self.type = type
+        self.accuracies = []
+        self.trainTimes = []
+        self.matrix = np.zeros((nClass, nClass), np.int64)
+
+    def add(self, trainTime, matrix):
+        self.accuracies.append(np.trace(matrix) / float(max(matrix.sum(), 1)))
+        self.trainTimes.append(trainTime)
+        self.matrix += matrix
+
+    @property
+    def meanAccuracy(self):
+        return np.mean(self.accuracies)
+
+    @property
+    def accuracyVar(self):
+        return np.var(self.accuracies)
+
+    @property
+    def meanTrainTime(self):
+        return np.mean(self.trainTimes)
+
+    @property
+    def trainTimeVar(self):
+        return np.var(self.trainTimes)
+
+    @property
+    def meanF1(self):
+        """Macro-averaged F1 over the classes present.
+        """
+        present = self.matrix.sum(axis=1) > 0
+        return np.mean(scores(self.matrix)[2][present])
+
+    def __str__(self):
+        res = "  Accuracy : %.2f %% (variance %.6f)\n" % (self.meanAccuracy * 100,
+                                                        self.accuracyVar)
+        res += "  Mean F1 : %.3f\n" % self.meanF1
+        res += "  Training time : %.4f s (variance %.6f)\n" % (self.meanTrainTime,
+                                                              self.trainTimeVar)
+        res += "  Folds : %s\n" % ', '.join("%.2f %%" % (accuracy * 100)
+                                            for accuracy in self.accuracies)
+        return res
+
+
+class CrossValidation(object):
+    """k-fold cross-validation of models on a dataset.
+    Features are computed once per pre-processing pipeline, then the
+    folds of every model are trained and tested by a pool of processes.
+    """
+    FOLDS = 5
+
+    def __init__(self, dataset, classes, folds=FOLDS, stratified=True,
+                 maxPerClass=100, workers=1, seed=None):
+        self._dataset = dataset
+        self._classes = classes
+        self._folds = folds
+        self._stratified = stratified
+        self._maxPerClass = maxPerClass
+        self._workers = workers
+        self._seed = seed
+
+    def run(self, types, log=None):
+        """Cross-validate the model types.
+        Returns a FoldResults per type, in an OrderedDict.
+        """
+        seed = self._seed
+        if seed is None:
+            seed = random.randrange(2 ** 31)
+        nClass = len(self._classes)
+        features, responses, _ = pipelineFeatures(self._dataset, self._classes, types,
+                                                  self._maxPerClass, 1,
+                                                  self._workers, seed, log)
+        features = dict((type, train) for type, (train, test) in features.items())
+        rand = np.random.RandomState(seed)
+        if self._stratified:
+            folds = stratifiedFolds(responses, self._folds, rand)
+        else:
+            folds = kFolds(len(responses), self._folds, rand)
+        jobs = [(type, fold) for type in types for fold in xrange(self._folds)]
+        args = (features, responses, folds, nClass)
+        if log:
+            log("Cross-validating {0} folds...\n".format(self._folds))
+        done = processMap(_runFold, jobs, self._workers, _initWorker, args)
+        _state.clear()
+        results = OrderedDict((type, FoldResults(type, nClass)) for type in types)
+        for type, fold, trainTime, matrix in done:
+            results[type].add(trainTime, matrix)
+        return results
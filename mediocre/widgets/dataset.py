@@ -20,6 +20,8 @@ from PyQt5.QtWidgets import (QAction, QFileDialog, QGridLayout, QGroupBox,
 
 from mediocre.dataset import Dataset, RandomParam
 from mediocre.paint_area import PaintArea
+from mediocre.parallel import workerCount
+from mediocre.qimage import arrayToPixmap
 from mediocre.widgets import BrushSizeWidget
 
 
@@ -246,8 +248,11 @@ class DatasetWidget(QWidget, DatasetWidgetUI):
                              self.heightBox.value(), self.minBrushSize.value(),
                              self.maxBrushSize.value(), self.xAngle.value(),
                              self.yAngle.value(), self.zAngle.value())
-        randoms = self._dataset.generateData(canvas, lines, params)
-        return randoms
+        lines = [((line.line().x1(), line.line().y1()),
+                  (line.line().x2(), line.line().y2())) for line in lines]
+        canvas = (canvas.x(), canvas.y(), canvas.width(), canvas.height())
+        return self._dataset.generateData(canvas, lines, params,
+                                          workers=workerCount())
 
     def saveImages(self):
         cl = self._classes[self._index]
@@ -263,6 +268,7 @@ class DatasetWidget(QWidget, DatasetWidgetUI):
         for random in randoms:
             self._dataset.addDatum(self.prefixLine.text(), cl, random,
                                    self.FORMAT)
+        randoms = [arrayToPixmap(random) for random in randoms]
         del self._last[:]
         self._last.append(pixmap)
         self._last.extend(randoms)
@@ -317,7 +323,7 @@ class DatasetWidget(QWidget, DatasetWidgetUI):
     def previewMode(self):
         randoms = self.generateRandom()
         for random in randoms:
-            self.previewWidget.addPixmap(random)
+            self.previewWidget.addPixmap(arrayToPixmap(random))
 
 
 __all__ = ["DatasetWidget"]
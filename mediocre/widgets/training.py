@@ -10,15 +10,62 @@
 #
 
 import os
+import threading
 
+from PyQt5.QtCore import QThread, pyqtSignal
 from PyQt5.QtGui import QFont, QTextCursor
-from PyQt5.QtWidgets import (QApplication, QComboBox, QFileDialog, QGridLayout,
+from PyQt5.QtWidgets import (QComboBox, QFileDialog, QGridLayout,
                              QGroupBox, QHBoxLayout, QLabel, QLineEdit,
-                             QPushButton, QSpinBox, QTextEdit, QVBoxLayout,
-                             QWidget)
+                             QProgressBar, QPushButton, QSpinBox, QTextEdit,
+                             QVBoxLayout, QWidget)
 
+from mediocre.augment import AugmentParam
+from mediocre.cache import FeatureCache
 from mediocre.dataset import Dataset
-from mediocre.ocr import OCR
+from mediocre.ocr import OCR, Progress, TrainingCancelled
+from mediocre.parallel import workerCount
+
+
+class TrainingWorker(QThread):
+    """Train and save a model out of the GUI thread.
+    OpenCV releases the GIL while it trains, so the GUI stays responsive.
+    """
+    logged = pyqtSignal(str)
+    progressed = pyqtSignal(object)
+    trained = pyqtSignal()
+    cancelled = pyqtSignal()
+    failed = pyqtSignal(str)
+
+    def __init__(self, dataset, classes, mode, trainRatio, maxPerClass,
+                 errorsIteration, workers, augmentation=None, memoryBudget=None,
+                 parent=None):
+        super(TrainingWorker, self).__init__(parent)
+        self._args = (dataset, classes, mode, trainRatio, maxPerClass,
+                      errorsIteration)
+        self._workers = workers
+        self._augmentation = augmentation
+        self._memoryBudget = memoryBudget
+        self._cancel = threading.Event()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def run(self):
+        ocr = OCR()
+        try:
+            ocr.trainModel(*self._args, log=self.logged.emit,
+                           workers=self._workers,
+                           progress=self.progressed.emit,
+                           cancel=self._cancel,
+                           augmentation=self._augmentation,
+                           memoryBudget=self._memoryBudget)
+            ocr.saveModel()
+        except TrainingCancelled:
+            self.cancelled.emit()
+        except Exception as e:
+            self.failed.emit(str(e))
+        else:
+            self.trained.emit()
 
 
 class TrainingWidgetUI(object):
@@ -43,6 +90,9 @@ class TrainingWidgetUI(object):
         self.maxPerClass = QSpinBox()
         self.mode = QComboBox()
         self.errorsIteration = QSpinBox()
+        self.workers = QSpinBox()
+        self.augmentation = QSpinBox()
+        self.memoryBudget = QSpinBox()
         layout.addWidget(QLabel(self.tr("Train ratio")), 0, 0)
         layout.addWidget(self.trainRatio, 0, 1)
         layout.addWidget(QLabel(self.tr("Maximum per class")), 1, 0)
@@ -51,22 +101,34 @@ class TrainingWidgetUI(object):
         layout.addWidget(self.mode, 3, 1)
         layout.addWidget(QLabel(self.tr("Errors iteration")), 2, 0)
         layout.addWidget(self.errorsIteration, 2, 1)
+        layout.addWidget(QLabel(self.tr("Workers")), 4, 0)
+        layout.addWidget(self.workers, 4, 1)
+        layout.addWidget(QLabel(self.tr("Variants per image")), 5, 0)
+        layout.addWidget(self.augmentation, 5, 1)
+        layout.addWidget(QLabel(self.tr("ANN memory budget")), 6, 0)
+        layout.addWidget(self.memoryBudget, 6, 1)
         groupBox.setLayout(layout)
         return groupBox
 
     def setupUI(self):
         layout = QVBoxLayout()
         self.outputText = QTextEdit()
+        self.progressBar = QProgressBar()
+        self.progressLabel = QLabel()
         self.trainButton = QPushButton(self.tr("Train"))
         self.trainButton.setMaximumWidth(200)
         self.trainButton.setFont(QFont('Arial', 15, QFont.Bold))
         hbox = QHBoxLayout()
-        hbox.addWidget(self.paramWidget())
+        self.params = self.paramWidget()
+        hbox.addWidget(self.params)
         hbox.addStretch(1)
         hbox.addWidget(self.trainButton)
         hbox.addStretch(1)
         layout.addLayout(hbox)
-        layout.addWidget(self.folderWidget())
+        self.folder = self.folderWidget()
+        layout.addWidget(self.folder)
+        layout.addWidget(self.progressBar)
+        layout.addWidget(self.progressLabel)
         layout.addWidget(self.outputText)
         self.setLayout(layout)
 
@@ -76,15 +138,26 @@ class TrainingWidget(QWidget, TrainingWidgetUI):
     MODE_KNN = "K-Nearest Neighbors"
     MODE_SVM = "Support Vector Machines"
     __modes = [MODE_ANN, MODE_KNN, MODE_SVM]
+    __stages = {
+        Progress.PREPROCESS: "Pre-processing",
+        Progress.AUGMENT: "Augmenting",
+        Progress.TRAIN: "Training",
+        Progress.TEST: "Testing",
+        Progress.ERRORS: "Injecting errors",
+        Progress.DONE: "Done"
+    }
 
     def __init__(self, classes_tree, parent=None):
         super(TrainingWidget, self).__init__(parent)
         self._classes_tree = classes_tree
+        self._worker = None
         self.setupUI()
         self.populateUI()
         self.connectUI()
         self.initUI()
-        self._dataset = Dataset(self.datasetFolder.text())
+        root = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+        cache = FeatureCache(os.path.join(root, "cache"))
+        self._dataset = Dataset(self.datasetFolder.text(), cache)
         self.datasetFolder.textChanged.connect(self._dataset.setFolder)
 
     def populateUI(self):
@@ -92,14 +165,20 @@ class TrainingWidget(QWidget, TrainingWidgetUI):
             self.mode.addItem(mode)
 
     def connectUI(self):
-        self.trainButton.clicked.connect(self.train)
+        self.trainButton.clicked.connect(self.trainOrCancel)
         self.selectFolderButton.clicked.connect(self.selectFolder)
 
     def initUI(self):
         self.trainRatio.setSuffix(' %')
         self.trainRatio.setRange(0, 100)
-        self.maxPerClass.setRange(1, 50000)
+        self.maxPerClass.setRange(1, 10000000)
         self.errorsIteration.setRange(0, 500)
+        self.workers.setRange(1, workerCount())
+        self.workers.setValue(workerCount())
+        self.augmentation.setRange(0, 100)
+        self.memoryBudget.setRange(0, 65536)
+        self.memoryBudget.setSuffix(' MB')
+        self.memoryBudget.setSpecialValueText(self.tr("Load all"))
         self.maxPerClass.setValue(400)
         self.trainRatio.setValue(50)
         root = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
@@ -117,7 +196,46 @@ class TrainingWidget(QWidget, TrainingWidgetUI):
         cursor.movePosition(QTextCursor.End)
         cursor.insertText(text)
         self.outputText.setTextCursor(cursor)
-        QApplication.processEvents()
+
+    def formatTime(self, seconds):
+        minutes, seconds = divmod(int(seconds), 60)
+        return "{0:02d}:{1:02d}".format(minutes, seconds)
+
+    def showProgress(self, progress):
+        self.progressBar.setRange(0, progress.total)
+        self.progressBar.setValue(progress.done)
+        text = "{0} {1}/{2}, {3} elapsed".format(self.__stages[progress.stage],
+                                                progress.done, progress.total,
+                                                self.formatTime(progress.elapsed))
+        if progress.eta is not None and progress.done < progress.total:
+            text += ", {0} left".format(self.formatTime(progress.eta))
+        self.progressLabel.setText(text)
+
+    def trainOrCancel(self):
+        if self._worker:
+            self._worker.cancel()
+            self.trainButton.setEnabled(False)
+            self.progressLabel.setText(self.tr("Cancelling..."))
+        else:
+            self.train()
+
+    def trainingFinished(self):
+        self._worker = None
+        self.params.setEnabled(True)
+        self.folder.setEnabled(True)
+        self.trainButton.setEnabled(True)
+        self.trainButton.setText(self.tr("Train"))
+
+    def trainingCancelled(self):
+        self.log("Training cancelled.\n")
+        self.progressLabel.setText(self.tr("Cancelled"))
+
+    def trainingSaved(self):
+        self.log("Model saved.\n")
+
+    def trainingFailed(self, message):
+        self.log("Training failed: {0}\n".format(message))
+        self.progressLabel.setText(self.tr("Failed"))
 
     def train(self):
         modes = {
@@ -127,12 +245,28 @@ class TrainingWidget(QWidget, TrainingWidgetUI):
         }
         mode = modes[self.__modes[self.mode.currentIndex()]]
         classes = self._classes_tree.getClasses()
-        ocr = OCR()
-        ocr.trainModel(self._dataset, classes, mode,
-                       self.trainRatio.value() / 100.0,
-                       self.maxPerClass.value(), self.errorsIteration.value(),
-                       self.log)
-        ocr.saveModel()
+        augmentation = None
+        if self.augmentation.value():
+            augmentation = AugmentParam(self.augmentation.value())
+        memoryBudget = None
+        if self.memoryBudget.value() and mode == OCR.MODEL_ANN:
+            memoryBudget = self.memoryBudget.value() * 1024 * 1024
+        self._worker = TrainingWorker(self._dataset, classes, mode,
+                                      self.trainRatio.value() / 100.0,
+                                      self.maxPerClass.value(),
+                                      self.errorsIteration.value(),
+                                      self.workers.value(), augmentation,
+                                      memoryBudget, self)
+        self._worker.logged.connect(self.log)
+        self._worker.progressed.connect(self.showProgress)
+        self._worker.trained.connect(self.trainingSaved)
+        self._worker.cancelled.connect(self.trainingCancelled)
+        self._worker.failed.connect(self.trainingFailed)
+        self._worker.finished.connect(self.trainingFinished)
+        self.params.setEnabled(False)
+        self.folder.setEnabled(False)
+        self.trainButton.setText(self.tr("Cancel"))
+        self._worker.start()
 
 
 __all__ = ["TrainingWidget"]